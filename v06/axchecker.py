@@ -22,6 +22,7 @@ from lib.pathutils import PathUtils, Progressor
 from lib.timestamp import TimeStamp
 from lib.logger import Logger
 from lib.mfdbreader import MfdbReader
+from lib.pathfilter import PathFilter, PrunedList
 
 class AxChecker:
 	'''Compare AXIOM case file / SQlite data base with paths'''
@@ -62,47 +63,70 @@ class AxChecker:
 		'''
 		self._set_output(filename, outdir, log)
 		self.log.info(f'Reading {self.mfdb_path.name}', echo=True)
+		path_cnt = 0
+		file_cnt = 0
 		with self.outdir.joinpath(f'{self.filename}_paths.tsv').open(mode='w', encoding='utf-8') as fh:
 			print('source_id\tsource_type\tsource_path', file=fh)
 			for source_id, source_type, source_path in self.mfdb.read_paths():
 				print(f'{source_id}\t{source_type}\t"{source_path}"', file=fh)
-		self.log.info(f'AXIOM case contains {len(self.mfdb.paths)} paths, {len(self.mfdb.file_ids)} are files', echo=True)
-		no_hit_ids = self.mfdb.file_ids - self.mfdb.get_hit_ids()
-		if no_hit_ids:
-			self.log.info(f'{len(no_hit_ids)} file(s) is/are not represented in hits', echo=True)
-			with self.outdir.joinpath(f'{self.filename}_not_in_hits.tsv').open(mode='w', encoding='utf-8') as fh:
-				for source_id in no_hit_ids:
-					source_type, source_path = self.mfdb.paths[source_id]
-					print(f'{source_id}\t{source_type}\t"{source_path}"', file=fh)
+				path_cnt += 1
+				if source_type == 'File':
+					file_cnt += 1
+		self.log.info(f'AXIOM case contains {path_cnt} paths, {file_cnt} are files', echo=True)
+		no_hit_cnt = 0
+		no_hits_path = self.outdir.joinpath(f'{self.filename}_not_in_hits.tsv')
+		with no_hits_path.open(mode='w', encoding='utf-8') as fh:
+			for source_id, source_type, source_path in self.mfdb.read_no_hits():
+				print(f'{source_id}\t{source_type}\t"{source_path}"', file=fh)
+				no_hit_cnt += 1
+		if no_hit_cnt:
+			self.log.info(f'{no_hit_cnt} file(s) is/are not represented in hits', echo=True)
+		else:
+			no_hits_path.unlink()
 
 	def compare(self, root_id, diff,
 			nohead = False,
 			encoding = None,
 			filename = None,
 			outdir = None,
+			include = None,
+			exclude = None,
 			log = None
 		):
-		'''Compare to CSV/TSV path list or existing file structure'''
+		'''Compare to CSV/TSV path list or existing file structure,
+			include/exclude are lists of glob or regex rules (PathFilter) that prune the walk of a directory
+		'''
 		self._set_output(filename, outdir, log)
 		if not root_id:
 			self.log.error('Missing root ID to compare')
 		diff_path = PathUtils.path(diff)
 		self.log.info(f'Reading {self.mfdb_path.name}', echo=True)
 		axiom_paths = self.mfdb.get_relative_paths(root_id)
-		self.log.info(f'Comparing {self.mfdb.paths[root_id][1]} recursivly to {diff_path.name}', echo=True)
+		self.log.info(f'Comparing {self.mfdb.get_path(root_id)[1]} recursivly to {diff_path.name}', echo=True)
 		missing_cnt = 0
 		if diff_path.is_dir():	# compare to dir
-			progress = Progressor(diff_path, echo=self.echo)
+			if include or exclude:
+				try:
+					prune = PathFilter(include=include, exclude=exclude)
+				except ValueError as ex:
+					self.log.error(f'Invalid filter rule {ex}')
+				pruned = PrunedList(self.outdir / f'{self.filename}_pruned.tsv')
+			else:
+				prune = pruned = None
+			progress = Progressor(diff_path, echo=self.echo, prune=prune)
 			if __os_name__ == 'nt':
 				normalize = PathUtils.normalize_win
 			else:
 				normalize = PathUtils.normalize_posix
 			with self.outdir.joinpath(f'{self.filename}_missing_files.txt').open(mode='w', encoding='utf-8') as fh:
-				for absolut_path, relative_path, tp in PathUtils.walk(diff_path):
-					progress.inc()
-					if tp == 'File' and not normalize(relative_path) in axiom_paths:
+				for absolut_path, relative_path, tp, stat in PathUtils.walk_stat(diff_path,
+					prune=prune, pruned=pruned.add if pruned else None):
+					progress.inc(stat.st_size if tp == 'file' and stat else 0)
+					if tp == 'file' and not normalize(relative_path) in axiom_paths:
 						print(relative_path, file=fh)
 						missing_cnt += 1
+			if pruned:
+				self.log.info(pruned.close(), echo=True)
 		elif diff_path.is_file:	# compare to file
 			if not encoding:
 				if __os_name__ == 'nt':
@@ -150,6 +174,10 @@ class AxCheckerCli(ArgumentParser):
 		self.add_argument('-f', '--filename', type=str,
 			help='Filename to generated (without extension)', metavar='STRING'
 		)
+		self.add_argument('-i', '--include', type=str, action='append',
+			help='Compare only files matching glob or regex (prefix "re:") when --diff is a directory, can be given multiple times',
+			metavar='RULE'
+		)
 		self.add_argument('-l', '--list', type=str,
 			help='List potential root IDs and paths by given max. path depth (!INTEGER = default)',
 			metavar='INTEGER'
@@ -163,6 +191,10 @@ class AxCheckerCli(ArgumentParser):
 		self.add_argument('-r', '--root', type=int,
 			help='ID of root path to compare', metavar='INTEGER'
 		)
+		self.add_argument('-u', '--exclude', type=str, action='append',
+			help='Skip files and directories matching glob or regex (prefix "re:") when --diff is a directory, can be given multiple times',
+			metavar='RULE'
+		)
 		self.add_argument('mfdb', nargs=1, type=Path,
 			help='AXIOM Case (.mfdb) / SQLite data base file', metavar='FILE'
 		)
@@ -174,6 +206,8 @@ class AxCheckerCli(ArgumentParser):
 		self.diff = args.diff
 		self.encoding = args.encoding
 		self.filename = args.filename
+		self.include = args.include
+		self.exclude = args.exclude
 		self.list = args.list
 		self.nohead = args.nohead
 		self.outdir = args.outdir
@@ -181,7 +215,7 @@ class AxCheckerCli(ArgumentParser):
 
 	def run(self):
 		'''Run AxChecker'''
-		axchecker = AxChecker(echo=echo)
+		axchecker = AxChecker(echo=self.echo)
 		axchecker.open(self.mfdb)
 		if self.list:
 			axchecker.list_roots(self.list)
@@ -191,7 +225,9 @@ class AxCheckerCli(ArgumentParser):
 				encoding = self.encoding,
 				nohead = self.nohead,
 				filename = self.filename,
-				outdir = self.outdir
+				outdir = self.outdir,
+				include = self.include,
+				exclude = self.exclude
 			)
 		else:
 			axchecker.check(filename=self.filename, outdir=self.outdir)
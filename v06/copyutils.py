@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from os import fstat
+from pathlib import Path
+from sqlite3 import connect as SqliteConnect
+from threading import Lock, BoundedSemaphore, Event, local
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from .hashes import FileHash, MultiHash, PieceHash
+from .devutils import DevUtils
+from .iogovernor import IoGovernor
+try:
+	from os import copy_file_range
+except ImportError:	# Linux only
+	copy_file_range = None
+try:
+	from os import sendfile
+except ImportError:	# Windows
+	sendfile = None
+try:
+	from os import posix_fallocate
+except ImportError:	# Windows and macOS
+	posix_fallocate = None
+try:
+	from fcntl import ioctl
+except ImportError:	# Windows
+	ioctl = None
+
+class CopyFile:
+	'''Copy one file to one or more destinations and hash the source on the fly, e.g. CopyFile(src, dst).sha256'''
+
+	FAST_SIZE = 67108864	# files of 64 MiB or more may be copied by the kernel
+	FICLONE = 0x40049409	# ioctl to create a reflink (Btrfs, XFS)
+	KERNEL_CHUNK = 1073741824	# bytes per system call
+	GOVERNED_CHUNK = 8388608	# smaller chunks when the bandwidth is limited
+
+	@staticmethod
+	def kernel_copy(src_fd, dst_fd, size):
+		'''Copy inside the kernel by reflink, copy_file_range or sendfile,
+			return the method or None if nothing was copied and the read/write loop has to do it
+		'''
+		if ioctl:
+			try:
+				ioctl(dst_fd, CopyFile.FICLONE, src_fd)
+				return 'reflink'
+			except OSError:	# other file system or no reflink support
+				pass
+		if posix_fallocate and size:
+			try:
+				posix_fallocate(dst_fd, 0, size)
+			except OSError:	# not supported by file system, e.g. FAT
+				pass
+		src_device = fstat(src_fd).st_dev
+		dst_device = fstat(dst_fd).st_dev
+		for method in ('copy_file_range', 'sendfile'):
+			offset = 0
+			try:
+				while offset < size:
+					chunk = min(CopyFile.GOVERNED_CHUNK if IoGovernor.active else CopyFile.KERNEL_CHUNK, size - offset)
+					if method == 'copy_file_range' and copy_file_range:
+						copied = copy_file_range(src_fd, dst_fd, chunk, offset, offset)
+					elif method == 'sendfile' and sendfile:
+						copied = sendfile(dst_fd, src_fd, offset, chunk)
+					else:
+						break
+					if not copied:	# source is shorter than expected
+						break
+					offset += copied
+					IoGovernor.draw(src_device, copied)
+					IoGovernor.draw(dst_device, copied)
+			except OSError:
+				if offset:	# failed in the middle of the file
+					raise
+				continue
+			if offset:
+				if offset < size:
+					raise OSError(f'Source ended after {offset} of {size} bytes')
+				return method
+
+	def __init__(self, src_path, dst_path, algorithms=['md5', 'sha256'], buffer=None, cache=None, writers=None,
+			fast_size=None, chunked_size=None):
+		'''Every block is read once from the source and given to the hashes and all destinations,
+			dst_path can be a list of paths, extra destinations are written concurrently by the writers (executor),
+			source digests are stored in the HashCache (if given) and compared to previous ones,
+			files with at least fast_size bytes and one destination are copied by the kernel if possible,
+			then digests are empty and deferred is True until set_digests() is called,
+			files with at least chunked_size bytes and one destination are copied in parallel pieces (PieceHash)
+		'''
+		self.src_path = Path(src_path)
+		self.dst_paths = [Path(path) for path in dst_path] if isinstance(dst_path, (list, tuple)) else [Path(dst_path)]
+		self.dst_path = self.dst_paths[0]
+		self.algorithms = list(algorithms)
+		self.size = 0
+		self.errors = [None for path in self.dst_paths]	# one per destination
+		self.cache_mismatch = list()
+		self.method = 'read/write'
+		self.deferred = False
+		self.pieces = None
+		self._cache = cache
+		if cache:
+			self._identity = cache.identity(self.src_path)
+		if buffer is None:
+			buffer = FileHash.new_buffer()
+		view = memoryview(buffer)
+		multi = MultiHash(self.algorithms)
+		own_writers = None
+		if len(self.dst_paths) > 1 and not writers:
+			writers = own_writers = ThreadPoolExecutor(max_workers=len(self.dst_paths) - 1)
+		try:
+			with self.src_path.open('rb', buffering=0) as src_fh, ExitStack() as stack:
+				dst_fhs = list()
+				for index, path in enumerate(self.dst_paths):
+					try:
+						dst_fhs.append(stack.enter_context(path.open('wb')))
+					except OSError as ex:
+						self.errors[index] = ex
+						dst_fhs.append(None)
+				src_device = fstat(src_fh.fileno()).st_dev
+				dst_devices = [fstat(dst_fh.fileno()).st_dev if dst_fh else None for dst_fh in dst_fhs]
+				src_size = fstat(src_fh.fileno()).st_size if len(dst_fhs) == 1 and dst_fhs[0] else -1
+				if chunked_size is not None and src_size >= chunked_size:	# pread/pwrite by parallel workers
+					self.pieces = PieceHash(self.src_path,
+						workers=DevUtils.default_workers(self.src_path, self.dst_path.parent))
+					chunked_digests = self.pieces.copy(dst_fhs[0], algorithms=self.algorithms)
+					self.method = 'chunked'
+					self.size = src_size
+				elif fast_size is not None and src_size >= fast_size:
+					if method := self.kernel_copy(src_fh.fileno(), dst_fhs[0].fileno(), src_size):
+						self.method = method
+						self.deferred = True
+						self.size = src_size
+				while self.method == 'read/write' and (size := src_fh.readinto(buffer)):
+					block = view[:size]
+					IoGovernor.draw(src_device, size)
+					for dst_device in dst_devices:
+						IoGovernor.draw(dst_device, size)
+					futures = [
+						(index, writers.submit(dst_fh.write, block))
+						for index, dst_fh in enumerate(dst_fhs[1:], start=1) if dst_fh
+					]
+					if dst_fhs[0]:
+						try:
+							dst_fhs[0].write(block)
+						except OSError as ex:
+							self.errors[0] = ex
+							dst_fhs[0] = None
+					multi.update(block)
+					for index, future in futures:	# buffer is reused by next read
+						try:
+							future.result()
+						except OSError as ex:
+							self.errors[index] = ex
+							dst_fhs[index] = None
+					self.size += size
+		except OSError as ex:	# source is not readable
+			self.errors = [ex for path in self.dst_paths]
+			self.deferred = False
+			self.set_digests(['' for alg in self.algorithms])
+		else:
+			if self.deferred:
+				for alg in self.algorithms:
+					setattr(self, alg, '')
+			elif self.pieces:
+				self.set_digests(chunked_digests)
+			else:
+				self.set_digests(multi.hexdigests())
+		finally:
+			if own_writers:
+				own_writers.shutdown()
+		self.error = next((error for error in self.errors if error), None)
+
+	def set_digests(self, digests):
+		'''Set source digests (list in the order of the algorithms), compare them to the hash cache'''
+		for alg, digest in zip(self.algorithms, digests):
+			setattr(self, alg, digest)
+		self.deferred = False
+		if self._cache and all(digests):
+			self.cache_mismatch = self._cache.check(self.src_path, self._identity, dict(zip(self.algorithms, digests)))
+
+	def __str__(self):
+		'''One line per algorithm'''
+		return '\n'.join(f'{alg}: {getattr(self, alg)}' for alg in self.algorithms)
+
+class CopyPool:
+	'''Copy files with parallel workers, bounded number of writers per destination device'''
+
+	IN_FLIGHT_PER_WORKER = 2
+
+	def __init__(self, algorithms=['md5', 'sha256'], workers=None, cache=None, fast_size=None, chunked_size=None):
+		'''Workers=None chooses the number by the device of the first source,
+			fast_size enables the kernel copy of large files (hashing is deferred to the caller),
+			chunked_size enables the parallel copy of pieces of huge files
+		'''
+		self.algorithms = list(algorithms)
+		self.workers = workers
+		self.cache = cache
+		self.fast_size = fast_size
+		self.chunked_size = chunked_size
+		self._local = local()
+		self._lock = Lock()
+		self._writers = dict()
+		self._executor = None
+		self._fan_out = None
+		self._cancel = Event()
+		self.exceptions = list()	# from workers or callbacks without failed()
+
+	def _device_writers(self, dst_path):
+		'''Get semaphore that limits the writers to the device of the destination directory'''
+		device = DevUtils.device_id(dst_path.parent)
+		with self._lock:
+			if not device in self._writers:
+				self._writers[device] = BoundedSemaphore(DevUtils.default_workers(dst_path.parent))
+			return device, self._writers[device]
+
+	def _copy(self, src_path, dst_paths):
+		'''Copy one file in worker thread, nothing is copied after cancel()'''
+		if self._cancel.is_set():
+			return
+		try:
+			buffer = self._local.buffer
+		except AttributeError:
+			buffer = self._local.buffer = FileHash.new_buffer()
+		devices = dict(self._device_writers(dst_path) for dst_path in dst_paths)
+		with ExitStack() as stack:
+			for device in sorted(devices, key=lambda device: (device is None, device)):	# same order in all workers
+				stack.enter_context(devices[device])
+			return CopyFile(src_path, dst_paths, algorithms=self.algorithms, buffer=buffer, cache=self.cache,
+				writers=self._fan_out, fast_size=self.fast_size, chunked_size=self.chunked_size)
+
+	def _finish(self, future, done, failed):
+		'''Hand result to callback and free slot'''
+		try:
+			copied = future.result()
+			if copied:
+				done(copied)
+		except Exception as ex:	# the executor would swallow it
+			if failed:
+				failed(ex)
+			else:
+				self.exceptions.append(ex)
+		finally:
+			self._in_flight.release()
+
+	def submit(self, src_path, dst_path, done, failed=None):
+		'''Copy file in worker thread and give CopyFile object to done(), blocks while too many files are in flight,
+			dst_path can be a list of destinations, unexpected exceptions are given to failed() or raised by join()
+		'''
+		dst_paths = list(dst_path) if isinstance(dst_path, (list, tuple)) else [dst_path]
+		if not self._executor:
+			workers = self.workers if self.workers else DevUtils.default_workers(src_path)
+			self._executor = ThreadPoolExecutor(max_workers=workers)
+			self._in_flight = BoundedSemaphore(workers * self.IN_FLIGHT_PER_WORKER)
+			if len(dst_paths) > 1:
+				self._fan_out = ThreadPoolExecutor(max_workers=workers * (len(dst_paths) - 1))
+		self._in_flight.acquire()
+		self._executor.submit(self._copy, src_path, dst_paths).add_done_callback(
+			lambda future: self._finish(future, done, failed))
+
+	def cancel(self):
+		'''Do not start files that are waiting for a worker, files that are being copied are finished'''
+		self._cancel.set()
+
+	def join(self):
+		'''Wait until all files are copied'''
+		if self._executor:
+			self._executor.shutdown(wait=True)
+		if self._fan_out:
+			self._fan_out.shutdown(wait=True)
+		if self.exceptions:
+			raise self.exceptions[0]
+
+class CopyJournal:
+	'''Journal (SQLite) of copied and verified files to resume an interrupted copy'''
+
+	def __init__(self, path, resume=False):
+		'''Open journal, start a new one if resume is False'''
+		self.path = Path(path)
+		if not resume:
+			self.path.unlink(missing_ok=True)
+		self._lock = Lock()
+		self.db = SqliteConnect(self.path, check_same_thread=False)
+		self.cursor = self.db.cursor()
+		self.cursor.execute('''CREATE TABLE IF NOT EXISTS "files" (
+			"source" TEXT, "source_size" INTEGER, "source_mtime_ns" INTEGER,
+			"destination" TEXT, "destination_size" INTEGER, "destination_mtime_ns" INTEGER,
+			"algorithms" TEXT, "digests" TEXT, PRIMARY KEY ("source", "destination"))''')
+		self.db.commit()
+
+	@staticmethod
+	def _stat(path):
+		'''Get size and modification time or None'''
+		try:
+			stat = Path(path).stat()
+		except OSError:
+			return None, None
+		return stat.st_size, stat.st_mtime_ns
+
+	def lookup(self, src_path, dst_path, algorithms):
+		'''Get digests as dict if source and all destinations did not change since they were journaled'''
+		dst_paths = dst_path if isinstance(dst_path, (list, tuple)) else [dst_path]
+		src_stat = self._stat(src_path)
+		digests = None
+		for path in dst_paths:
+			with self._lock:
+				self.cursor.execute('SELECT * FROM "files" WHERE "source" = ? AND "destination" = ?',
+					(f'{src_path}', f'{path}'))
+				row = self.cursor.fetchone()
+			if not row:
+				return
+			source, src_size, src_mtime_ns, destination, dst_size, dst_mtime_ns, algs, this_digests = row
+			this_digests = dict(zip(algs.split(','), this_digests.split('\t')))
+			if (
+				src_stat != (src_size, src_mtime_ns)
+				or self._stat(path) != (dst_size, dst_mtime_ns)
+				or any(not alg in this_digests for alg in algorithms)
+				or digests and any(this_digests[alg] != digests[alg] for alg in algorithms)
+			):
+				return
+			digests = this_digests
+		return digests
+
+	def add(self, src_path, dst_path, digests):
+		'''Journal one verified file in one destination, digests are given as dict'''
+		with self._lock:
+			self.cursor.execute('INSERT OR REPLACE INTO "files" VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+				f'{src_path}', *self._stat(src_path), f'{dst_path}', *self._stat(dst_path),
+				','.join(digests), '\t'.join(digests.values())
+			))
+
+	def commit(self):
+		'''Write journal entries to disk'''
+		with self._lock:
+			self.db.commit()
+
+	def close(self):
+		'''Commit and close journal'''
+		self.commit()
+		self.db.close()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from os import cpu_count, open as os_open, close as os_close, fstat, O_RDONLY, O_RDWR, name as os_name
+from pathlib import Path
+from struct import Struct
+try:
+	from os import major, minor
+except ImportError:	# Windows has no device numbers
+	major = minor = None
+try:
+	from os import fdatasync
+except ImportError:	# Windows and macOS
+	from os import fsync as fdatasync
+try:
+	from fcntl import ioctl
+except ImportError:	# Windows
+	ioctl = None
+try:	# syncfs() flushes one file system, os.sync() would flush all of them
+	from ctypes import CDLL
+	_syncfs = CDLL(None, use_errno=True).syncfs
+except (ImportError, OSError, AttributeError, TypeError):
+	_syncfs = None
+try:	# drive type tells network shares on Windows
+	from ctypes import windll
+	_get_drive_type = windll.kernel32.GetDriveTypeW
+except (ImportError, OSError, AttributeError):
+	_get_drive_type = None
+
+class DevUtils:
+	'''Information about the block devices holding files (uses sysfs on Linux)'''
+
+	SYS_DEV_BLOCK = Path('/sys/dev/block')
+	PROC_MOUNTINFO = Path('/proc/self/mountinfo')
+	REMOTE_FS = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'sshfs', '9p', 'afs', 'ceph', 'glusterfs', 'davfs', 'fuse', 'fuseblk')
+	DRIVE_REMOTE = 4	# GetDriveTypeW
+	REMOTE_WALKERS = 8	# directory listings in parallel to hide the latency of round trips
+	ROTATIONAL_WORKERS = 1	# parallel reads make spinning disks seek
+	SOLID_STATE_WORKERS = 8
+	UNKNOWN_WORKERS = 2	# e.g. network shares, FUSE, Windows
+	FS_IOC_FIEMAP = 0xC020660B
+	FIEMAP = Struct('=QQIIII')	# start, length, flags, mapped extents, extent count, reserved
+	FIEMAP_EXTENT = Struct('=QQQQQIIII')	# logical, physical, length, 2 reserved, flags, 3 reserved
+
+	@staticmethod
+	def device_id(path):
+		'''Get device id (st_dev) of the file system holding path, None if not accessible'''
+		try:
+			return Path(path).stat().st_dev
+		except OSError:
+			return None
+
+	@staticmethod
+	def sys_block(path):
+		'''Get sysfs directory of the (whole) block device holding path or None'''
+		st_dev = DevUtils.device_id(path)
+		if st_dev is None or not major:
+			return
+		try:
+			dev_path = DevUtils.SYS_DEV_BLOCK.joinpath(f'{major(st_dev)}:{minor(st_dev)}').resolve(strict=True)
+		except OSError:
+			return
+		if dev_path.joinpath('partition').is_file():
+			dev_path = dev_path.parent
+		if dev_path.joinpath('queue').is_dir():
+			return dev_path
+
+	@staticmethod
+	def is_rotational(path):
+		'''Return True for spinning disks, False for SSD/NVMe and None if undetectable'''
+		dev_path = DevUtils.sys_block(path)
+		if not dev_path:
+			return
+		try:
+			return dev_path.joinpath('queue', 'rotational').read_text().strip() == '1'
+		except OSError:
+			return
+
+	@staticmethod
+	def fs_type(path):
+		'''Get file system type of the mount holding path from mountinfo (Linux) or None'''
+		st_dev = DevUtils.device_id(path)
+		if st_dev is None or not major:
+			return
+		dev = f'{major(st_dev)}:{minor(st_dev)}'
+		try:
+			with DevUtils.PROC_MOUNTINFO.open(encoding='utf-8') as fh:
+				for line in fh:	# id parent major:minor root mountpoint options [optional fields] - type source ...
+					fields = line.split()
+					if len(fields) > 2 and fields[2] == dev and '-' in fields:
+						return fields[fields.index('-') + 1]
+		except (OSError, IndexError):
+			return
+
+	@staticmethod
+	def is_remote(path):
+		'''Return True if path is on a network share or a FUSE mount (e.g. ewfmount), every metadata access is a round trip there'''
+		if _get_drive_type:
+			path = Path(path).absolute()
+			return path.drive.startswith('\\\\') or _get_drive_type(f'{path.drive}\\') == DevUtils.DRIVE_REMOTE
+		fs_type = DevUtils.fs_type(path)
+		return bool(fs_type) and (fs_type in DevUtils.REMOTE_FS or fs_type.startswith('fuse.'))
+
+	@staticmethod
+	def walk_workers(path):
+		'''Get number of directories to list in parallel, only remote or FUSE file systems profit'''
+		return DevUtils.REMOTE_WALKERS if DevUtils.is_remote(path) else 1
+
+	@staticmethod
+	def physical_order(path):
+		'''Get sort key to read files in the order of their position on disk:
+			(device, 0, physical offset of first extent) from FIEMAP, (device, 1, inode) if not available
+		'''
+		try:
+			fd = os_open(path, O_RDONLY)
+		except OSError:
+			return -1, 2, 0
+		try:
+			stat = fstat(fd)
+			if ioctl:
+				buffer = bytearray(DevUtils.FIEMAP.size + DevUtils.FIEMAP_EXTENT.size)
+				DevUtils.FIEMAP.pack_into(buffer, 0, 0, 0xffffffffffffffff, 0, 0, 1, 0)
+				try:
+					ioctl(fd, DevUtils.FS_IOC_FIEMAP, buffer, True)
+				except OSError:	# not supported by file system
+					pass
+				else:
+					if DevUtils.FIEMAP.unpack_from(buffer)[3] > 0:	# mapped extents, empty files have none
+						return stat.st_dev, 0, DevUtils.FIEMAP_EXTENT.unpack_from(buffer, DevUtils.FIEMAP.size)[1]
+			return stat.st_dev, 1, stat.st_ino
+		finally:
+			os_close(fd)
+
+	@staticmethod
+	def syncfs(path):
+		'''Flush the file system holding path to disk, return False if syncfs is not available'''
+		if not _syncfs:
+			return False
+		try:
+			fd = os_open(path, O_RDONLY)
+		except OSError:
+			return False
+		try:
+			return _syncfs(fd) == 0
+		finally:
+			os_close(fd)
+
+	@staticmethod
+	def fdatasync(path):
+		'''Flush the data of one file to disk, return False on error'''
+		try:
+			fd = os_open(path, O_RDWR if os_name == 'nt' else O_RDONLY)	# Windows only flushes writable handles
+		except OSError:
+			return False
+		try:
+			fdatasync(fd)
+			return True
+		except OSError:
+			return False
+		finally:
+			os_close(fd)
+
+	@staticmethod
+	def sync_files(paths):
+		'''Make files durable: syncfs once per file system, fdatasync per file as fallback'''
+		devices = dict()
+		for path in paths:
+			devices.setdefault(DevUtils.device_id(path), list()).append(path)
+		for st_dev, dev_paths in devices.items():
+			if st_dev is None or not DevUtils.syncfs(dev_paths[0]):
+				for path in dev_paths:
+					DevUtils.fdatasync(path)
+
+	@staticmethod
+	def default_workers(*paths):
+		'''Get number of parallel readers that suits the slowest device of the given paths'''
+		workers = None
+		for path in paths:
+			rotational = DevUtils.is_rotational(path)
+			if rotational:
+				this_workers = DevUtils.ROTATIONAL_WORKERS
+			elif rotational is None:
+				this_workers = DevUtils.UNKNOWN_WORKERS
+			else:
+				this_workers = min(DevUtils.SOLID_STATE_WORKERS, cpu_count() or 1)
+			workers = this_workers if workers is None else min(workers, this_workers)
+		return workers if workers else DevUtils.UNKNOWN_WORKERS
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from heapq import merge
+from tempfile import TemporaryFile
+
+class ExternalSort:
+	'''Sort lines (e.g. rows of a TSV) in bounded memory: sorted runs are spilled to temporary files and merged'''
+
+	MAX_LINES = 1000000	# lines held in memory, this bounds the memory usage
+	MAX_RUNS = 64	# runs that are merged at once (open files)
+
+	def __init__(self, key=None, max_lines=MAX_LINES, tmpdir=None):
+		'''Lines are sorted by key function (default: whole line), the sort is stable'''
+		self.key = key
+		self.max_lines = max_lines
+		self.tmpdir = tmpdir
+		self._lines = list()
+		self._runs = list()	# temporary files with sorted lines
+
+	def _run(self, lines):
+		'''Write sorted lines to a temporary file'''
+		fh = TemporaryFile('w+', encoding='utf-8', newline='\n', dir=self.tmpdir)
+		for line in lines:
+			fh.write(f'{line}\n')
+		fh.seek(0)
+		return fh
+
+	@staticmethod
+	def _read(fh):
+		'''Generate lines of a run and close it at the end'''
+		with fh:
+			for line in fh:
+				yield line[:-1]
+
+	def _merged(self, runs):
+		'''Merge runs, keeps order of equal keys as runs are given in the order of the input'''
+		return merge(*(self._read(fh) for fh in runs), key=self.key)
+
+	def _spill(self):
+		'''Sort lines in memory and write them as one run'''
+		self._lines.sort(key=self.key)
+		self._runs.append(self._run(self._lines))
+		self._lines.clear()
+		if len(self._runs) >= self.MAX_RUNS:	# merge to one run to limit the number of open files
+			self._runs = [self._run(self._merged(self._runs))]
+
+	def add(self, line):
+		'''Add one line (without newline)'''
+		self._lines.append(line)
+		if len(self._lines) >= self.max_lines:
+			self._spill()
+
+	def extend(self, lines):
+		'''Add lines'''
+		for line in lines:
+			self.add(line)
+
+	def sorted(self):
+		'''Generate all lines in sorted order, in memory if they never exceeded max_lines'''
+		if not self._runs:
+			self._lines.sort(key=self.key)
+			yield from self._lines
+			self._lines.clear()
+			return
+		if self._lines:
+			self._spill()
+		runs = self._runs
+		self._runs = list()
+		yield from self._merged(runs)
+
+	@staticmethod
+	def column_key(column):
+		'''Get key function that sorts TSV lines by one column, missing columns (e.g. blank lines) give an empty key'''
+		def key(line):
+			row = line.split('\t', column + 1)
+			return row[column] if column < len(row) else ''
+		return key
+
+	@staticmethod
+	def sort_tsv(src, dst, column=0, max_lines=MAX_LINES, tmpdir=None):
+		'''Sort TSV file by column (number), the head line stays on top, return number of rows'''
+		ext_sort = ExternalSort(key=ExternalSort.column_key(column), max_lines=max_lines, tmpdir=tmpdir)
+		with open(src, encoding='utf-8') as fh:
+			head = fh.readline().rstrip('\n')
+			for line in fh:
+				ext_sort.add(line.rstrip('\n'))
+		cnt = 0
+		with open(dst, 'w', encoding='utf-8') as fh:
+			print(head, file=fh)
+			for line in ext_sort.sorted():
+				print(line, file=fh)
+				cnt += 1
+		return cnt
+
+	@staticmethod
+	def diff(items_a, items_b):
+		'''Compare two streams of (key, value) sorted by key in one pass (streaming merge),
+			generate (key, difference, value_a, value_b) with difference "only_a", "only_b" or "differ"
+		'''
+		items_a = iter(items_a)
+		items_b = iter(items_b)
+		item_a = next(items_a, None)
+		item_b = next(items_b, None)
+		while item_a or item_b:
+			if not item_b or item_a and item_a[0] < item_b[0]:
+				yield item_a[0], 'only_a', item_a[1], None
+				item_a = next(items_a, None)
+			elif not item_a or item_b[0] < item_a[0]:
+				yield item_b[0], 'only_b', None, item_b[1]
+				item_b = next(items_b, None)
+			else:
+				if item_a[1] != item_b[1]:
+					yield item_a[0], 'differ', item_a[1], item_b[1]
+				item_a = next(items_a, None)
+				item_b = next(items_b, None)
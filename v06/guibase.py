@@ -12,7 +12,8 @@ from tkinter.scrolledtext import ScrolledText
 from .worker import Worker
 from .guielements import ExpandedNotebook, ExpandedFrame, ExpandedScrolledText
 from .guielements import LeftButton, RightButton, LeftLabel, ChildWindow
-from .guielements import GridScrolledText, GridFrame, GridButton
+from .guielements import GridScrolledText, GridFrame, GridButton, StringSelector, Error
+from .iogovernor import IoGovernor
 from .guilabeling import BasicLabels
 from .guiconfig import GuiConfig
 if __os__ == 'posix':
@@ -106,11 +107,25 @@ class GuiBase(Tk):
 			int(self.root_height / (2*self.font_size)),
 			ro=True
 		)
+		self.io_limit = self.settings.init_stringvar('IoLimit', section='Base')
+		StringSelector(self.info_window, self.io_limit, BasicLabels.IO_LIMIT, command=self._set_io_limit,
+			width=GuiConfig.BUTTON_WIDTH, column=0, tip=BasicLabels.TIP_IO_LIMIT)
+		self._set_io_limit()
 		self.stop_button = GridButton(self.info_window, BasicLabels.QUIT, self._close_infos, sticky='e')
 		self.info_window.set_minsize()
 		self.worker = Worker(self)
 		self.worker.start()
 
+	def _set_io_limit(self):
+		'''Change bandwidth limit of running jobs'''
+		try:
+			self.io_limit_mbps = IoGovernor.parse_mbps(self.io_limit.get())
+		except ValueError:
+			self.io_limit_mbps = None	# do not keep an invalid limit for later jobs
+			Error(BasicLabels.INVALID_IO_LIMIT)
+			return
+		IoGovernor.set_mbps(self.io_limit_mbps)
+
 	def finished_jobs(self):
 		'''This is called from worker when all jobs are done.'''
 		self.worker = None
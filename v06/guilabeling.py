@@ -73,6 +73,10 @@ click to auto generate (if empty)'''
 	YES = 'Yes'
 	NO = 'No'
 	CALCULATE_HASHES = 'Calculate hash(es)'
+	IO_LIMIT = 'Set MB/s limit'
+	TIP_IO_LIMIT = '''Limit I/O bandwidth per device of running jobs
+(empty or 0 = no limit), e.g. to give priority to an acquisition'''
+	INVALID_IO_LIMIT = 'Limit has to be a positive number (MB/s) or 0 (no limit)'
 
 class SettingsLabels(BasicLabels):
 	SUDO = 'Get admin privileges'
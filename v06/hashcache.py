@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from sqlite3 import connect as SqliteConnect, Error as SqliteError
+from threading import Lock
+from time import time_ns
+from pathlib import Path
+
+class HashCache:
+	'''Persistent SQLite cache for file hashes keyed on file identity,
+		it can be shared by concurrent processes, if it is unavailable files are hashed as without cache
+	'''
+
+	DEFAULT_PATH = Path.home() / '.cache' / 'fallbackimager_hashes.db'
+	MAX_ENTRIES = 10000000	# least recently used digests are evicted above this
+	BUSY_TIMEOUT = 30	# seconds to wait for the write lock of another process
+
+	@staticmethod
+	def identity(path):
+		'''Get identity of a file (st_dev, st_ino, size, mtime_ns, ctime_ns) or None'''
+		try:
+			stat = Path(path).stat()
+		except OSError:
+			return
+		return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns
+
+	def __init__(self, path=None, max_entries=None, log=None):
+		'''Open or create cache database, cache hits are logged if logger is given'''
+		self.path = Path(path) if path else self.DEFAULT_PATH
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self.max_entries = max_entries if max_entries else self.MAX_ENTRIES
+		self.log = log
+		self._lock = Lock()
+		self.cached_cnt = 0
+		self.calculated_cnt = 0
+		self.db = None
+		try:
+			self.db = SqliteConnect(self.path, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+			self.cursor = self.db.cursor()
+			self.cursor.execute('PRAGMA journal_mode=WAL')	# readers do not block the writer and vice versa
+			self.cursor.execute('PRAGMA synchronous=NORMAL')	# commits are cheap in WAL mode without fsync
+			self.cursor.execute('''CREATE TABLE IF NOT EXISTS "hashes" (
+				"dev" INTEGER, "ino" INTEGER, "size" INTEGER, "mtime_ns" INTEGER, "ctime_ns" INTEGER,
+				"algorithm" TEXT, "digest" TEXT, "last_used" INTEGER,
+				PRIMARY KEY ("dev", "ino", "size", "mtime_ns", "ctime_ns", "algorithm"))''')
+			self.cursor.execute('CREATE INDEX IF NOT EXISTS "hashes_last_used" ON "hashes" ("last_used")')
+			self.db.commit()
+		except SqliteError as ex:
+			self._unavailable(ex)
+
+	def _unavailable(self, ex):
+		'''Stop using the cache (has to be called with lock or from constructor), files are hashed fresh'''
+		if self.log:
+			self.log.warning(f'Hash cache {self.path} is unavailable, hashing without cache: {ex}')
+		if self.db:
+			try:
+				self.db.close()
+			except SqliteError:
+				pass
+		self.db = None
+
+	def _lookup(self, identity, algorithms):
+		'''Get cached digests as dict {algorithm: digest}'''
+		cached = dict()
+		for alg in algorithms:
+			self.cursor.execute('''SELECT "digest" FROM "hashes" WHERE "dev" = ? AND "ino" = ?
+				AND "size" = ? AND "mtime_ns" = ? AND "ctime_ns" = ? AND "algorithm" = ?''', (*identity, alg))
+			row = self.cursor.fetchone()
+			if row:
+				cached[alg] = row[0]
+		return cached
+
+	def _store(self, identity, digests):
+		'''Insert or replace digests given as dict {algorithm: digest}'''
+		now = time_ns()
+		self.cursor.executemany('INSERT OR REPLACE INTO "hashes" VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+			((*identity, alg, digest, now) for alg, digest in digests.items() if digest))
+		self.db.commit()	# one short write transaction per file, other processes wait for the lock
+
+	def get(self, path, identity, algorithms):
+		'''Get cached digests as dict {algorithm: digest} and log what came from cache'''
+		if not identity:
+			return dict()
+		with self._lock:
+			if not self.db:
+				return dict()
+			try:
+				cached = self._lookup(identity, algorithms)
+				if cached:
+					self.cursor.execute('''UPDATE "hashes" SET "last_used" = ? WHERE "dev" = ? AND "ino" = ?
+						AND "size" = ? AND "mtime_ns" = ? AND "ctime_ns" = ?''', (time_ns(), *identity))
+					self.db.commit()
+			except SqliteError as ex:
+				self._unavailable(ex)
+				return dict()
+			if cached:
+				self.cached_cnt += len(cached)
+				if self.log:
+					self.log.info(f'Hash cache: {", ".join(cached)} of {path} taken from cache')
+			return cached
+
+	def put(self, path, identity, digests):
+		'''Store freshly calculated digests given as dict {algorithm: digest}'''
+		with self._lock:
+			self.calculated_cnt += len(digests)
+			if self.db and identity and HashCache.identity(path) == identity:	# skip files changed while hashing
+				try:
+					self._store(identity, digests)
+				except SqliteError as ex:
+					self._unavailable(ex)
+
+	def check(self, path, identity, digests):
+		'''Store freshly calculated digests and return algorithms where the cache differed'''
+		with self._lock:
+			self.calculated_cnt += len(digests)
+			if not self.db or not identity or HashCache.identity(path) != identity:
+				return list()
+			try:
+				cached = self._lookup(identity, digests)
+				self._store(identity, digests)
+			except SqliteError as ex:
+				self._unavailable(ex)
+				return list()
+			return [alg for alg, digest in cached.items() if digest != digests[alg]]
+
+	def evict(self):
+		'''Delete least recently used digests exceeding max_entries'''
+		with self._lock:
+			if not self.db:
+				return 0
+			try:
+				self.cursor.execute('SELECT COUNT(*) FROM "hashes"')
+				surplus = self.cursor.fetchone()[0] - self.max_entries
+				if surplus > 0:
+					self.cursor.execute('''DELETE FROM "hashes" WHERE rowid IN
+						(SELECT rowid FROM "hashes" ORDER BY "last_used" LIMIT ?)''', (surplus,))
+				self.db.commit()
+			except SqliteError as ex:
+				self._unavailable(ex)
+				return 0
+			return max(surplus, 0)
+
+	def close(self):
+		'''Evict old entries, log statistics and close database'''
+		evicted = self.evict()
+		if self.log:
+			msg = f'Hash cache {self.path}: {self.cached_cnt} digest(s) taken from cache, {self.calculated_cnt} calculated'
+			if evicted:
+				msg += f', {evicted} old digest(s) evicted'
+			self.log.info(msg)
+		if self.db:
+			self.db.close()
@@ -9,89 +9,500 @@ __email__ = 'markus.thilo@gmail.com'
 __status__ = 'Testing'
 __description__ = '''
 Safe copy with log and hashes.
+Paths in the tree digest manifest start with the name of the source as it is copied to the destination root,
+so the manifest can be compared to the one ZipImager writes for the same source directory.
 '''
 
 from pathlib import Path
-from threading import Thread
+from threading import Thread, BoundedSemaphore, Event
+from queue import Queue, Empty
+from heapq import heappush, heappop
+from itertools import tee
+from tempfile import TemporaryFile
+from time import perf_counter
 from argparse import ArgumentParser
-from lib.pathutils import PathUtils, Progressor
+from lib.pathutils import PathUtils
 from lib.timestamp import TimeStamp
 from lib.logger import Logger
-from lib.hashes import FileHash
-try:
-	from os import sync as os_sync
-	def sync(): os_sync()
-except ImportError:
-	def sync(): pass
+from lib.stringutils import StringUtils
+from lib.hashes import FileHash, HashPool, PieceHash
+from lib.hashcache import HashCache
+from lib.hashindex import HashFlags
+from lib.copyutils import CopyFile, CopyPool, CopyJournal
+from lib.devutils import DevUtils
+from lib.treedigest import TreeDigest
+from lib.iogovernor import IoGovernor
+from lib.pathfilter import PathFilter, PrunedList
+from lib.extsort import ExternalSort
 
 class HashedCopy:
 	'''Tool to copy files and verify the outcome using hashes'''
 
+	MAX_PENDING = 65536	# items between walk and TSV, this bounds the memory usage
+	MAX_HELD = MAX_PENDING // 2	# items passed after the oldest file in the window, the walk must not block on them
+	COPY_WINDOW = 256	# files are sorted largest first inside this window
+	PHYSICAL_WINDOW = 4096	# or by their position on the source disk
+	VERIFY_FILES = 256	# files that are synced and verified together
+	VERIFY_BYTES = 1073741824	# or bytes (1 GiB)
+	VERIFY_IDLE = 1	# seconds to wait for more files before an incomplete batch is verified
+	PROGRESS_INTERVAL = 1000
+	CANCEL_POLL = 1	# seconds between checks for cancel while the walk waits for a pending slot
+
 	def __init__(self, echo=print):
 		'''Create object'''
 		self.available = True
 		self.echo = echo
 
-	def cp(self, sources, destination, filename=None, outdir=None, log=None):
-		'''Copy multiple sources'''
-		self.dst_root_path = Path(destination)
+	def _size(self, path):
+		'''Get file size to schedule copy jobs'''
+		try:
+			return path.stat().st_size
+		except OSError:
+			return 0
+
+	def _dst_paths(self, *parts):
+		'''Get the paths of one item in all destination roots'''
+		return [dst_root_path.joinpath(*parts) for dst_root_path in self.dst_root_paths]
+
+	def _mkdirs(self, dst_paths):
+		'''Create directory in all destinations'''
+		for dst_path in dst_paths:
+			dst_path.mkdir(parents=True, exist_ok=True)
+
+	def _walk(self, source_paths):
+		'''Create directories and generate (type, source, destinations, size)'''
+		for source_path in source_paths:
+			root_dst_paths = self._dst_paths(source_path.name)
+			if source_path.is_dir():
+				self._mkdirs(root_dst_paths)
+				yield 'dir', source_path, root_dst_paths, 0
+				for abs_path, rel_path, tp, stat in PathUtils.walk_stat(source_path,
+					prune=self.prune, pruned=self.pruned.add if self.pruned else None):
+					dst_paths = self._dst_paths(source_path.name, rel_path)
+					if tp == 'dir':
+						self._mkdirs(dst_paths)
+						yield 'dir', abs_path, dst_paths, 0
+					elif tp == 'file':
+						yield 'file', abs_path, dst_paths, stat.st_size if stat else 0
+					else:
+						yield 'other', abs_path, dst_paths, 0
+			elif source_path.is_file():
+				yield 'file', source_path, root_dst_paths, self._size(source_path)
+			else:
+				yield 'other', source_path, root_dst_paths, 0
+
+	def _stage(self, target, *args):
+		'''Run pipeline stage in thread, the last argument is the queue of the next stage'''
+		def run():
+			try:
+				target(*args)
+			except Exception as ex:
+				self._exceptions.append(ex)
+			finally:
+				args[-1].put(None)	# tell next stage that there is nothing more to come
+		thread = Thread(target=run, daemon=True)
+		thread.start()
+		return thread
+
+	def _walk_stage(self, source_paths, copy_queue):
+		'''Walk sources and number the items in the order of the TSV, stop on cancel'''
+		for index, item in enumerate(self._walk(source_paths)):
+			while not self._pending.acquire(timeout=self.CANCEL_POLL):	# slots of a failed stage are never released
+				if self._cancel.is_set():
+					return
+			if self._cancel.is_set():
+				return
+			copy_queue.put((index, *item))
+
+	def _copy_stage(self, copy_queue, verify_queue):
+		'''Give files to the copy workers, largest first or in physical order inside a window,
+			on cancel the queue is drained without copying so the walk can end
+		'''
+		window = list()
+		def submit_window():
+			if self.physical:	# minimize seeks of spinning disks
+				window.sort(key=lambda item: DevUtils.physical_order(item[2]))
+			else:
+				window.sort(key=lambda item: item[4], reverse=True)
+			for index, tp, src_path, dst_paths, size in window:
+				if self._cancel.is_set():
+					break
+				self._pool.submit(src_path, dst_paths, lambda copied, index=index: verify_queue.put((index, 'file', copied)),
+					lambda ex, index=index: verify_queue.put((index, 'failed', ex)))
+			window.clear()
+		try:
+			while item := copy_queue.get():
+				if self._cancel.is_set():
+					window.clear()
+					continue
+				if item[1] != 'file':
+					verify_queue.put((item[0], item[1], item))
+				elif self.resume and (digests := self.journal.lookup(item[2], item[3], self.src_algs)):
+					verify_queue.put((item[0], 'journaled', (item[2], item[3], item[4], digests)))
+					self._journaled_cnt += 1
+				else:
+					window.append(item)
+				if window and (len(window) >= self.copy_window or not self.physical and copy_queue.empty()
+					or item[0] - window[0][0] >= self.MAX_HELD):	# items behind the window hold pending slots
+					submit_window()
+			submit_window()
+		finally:
+			self._pool.join()
+
+	def _relative(self, dst_path):
+		'''Get path relative to the (first) destination root for the tree digest, it starts with the name of the source'''
+		return dst_path.relative_to(self.dst_root_paths[0])
+
+	def _file_row(self, index, src_path, dst_paths, size, digests, dst_digests, warnings, row_queue):
+		'''Build TSV row for one file and give it to the writer, dst_digests is a list of (md5, sha256)'''
+		(dst_md5, dst_sha256), *more_dst_digests = dst_digests
+		line = f'{src_path}\t{dst_paths[0]}\tfile\t{digests["md5"]}\t{dst_md5}\t{digests["sha256"]}\t{dst_sha256}'
+		for dst_path, (dst_md5, dst_sha256) in zip(dst_paths[1:], more_dst_digests):
+			line += f'\t{dst_path}\t{dst_md5}\t{dst_sha256}'
+		success = bool(digests['md5'])
+		for dst_path, (dst_md5, dst_sha256) in zip(dst_paths, dst_digests):
+			if digests['md5'] != dst_md5 or digests['sha256'] != dst_sha256:
+				success = False
+				if len(dst_paths) > 1:
+					warnings.append(f'Verification of {dst_path} failed')
+		line += '\tyes' if success else '\tno'
+		flag = ''
+		if self.flags:
+			flag = self.flags.flag(digests)
+			if flag == HashFlags.ALERT:
+				warnings.append(f'Hash of {src_path} is in alert list')
+			line += f'\t{flag}'
+		row_queue.put((index, 'file', line, success, flag, warnings,	# tree digest of what has been verified in the destination
+			(self._relative(dst_paths[0]), 'file', size, dst_digests[0][1] if dst_digests[0][1] else '')))
+		return success
+
+	def _hash_deferred(self, deferred):
+		'''Hash sources that have been copied by the kernel'''
+		src_hashes = HashPool(algorithms=self.src_algs, per_device=True).map(copied.src_path for copied in deferred)
+		for copied, digests in zip(deferred, src_hashes):
+			copied.set_digests(digests)
+
+	def _verify_batch(self, batch, row_queue):
+		'''Sync and read back copied files, one reader per destination device,
+			sources copied by the kernel are hashed at the same time
+		'''
+		deferred = [copied for index, copied in batch if copied.deferred]
+		if deferred:
+			src_thread = Thread(target=self._hash_deferred, args=(deferred,), daemon=True)
+			src_thread.start()
+		start_time = perf_counter()
+		DevUtils.sync_files(dst_path for index, copied in batch for dst_path in copied.dst_paths)
+		sync_time = perf_counter()
+		self._sync_seconds += sync_time - start_time
+		start_time = sync_time
+		dst_hashes = HashPool(algorithms=['md5', 'sha256'], per_device=True, uncached=True).map(
+			dst_path for index, copied in batch for dst_path in copied.dst_paths)	# every destination on its own
+		dst_hashes = list(dst_hashes)
+		if deferred:
+			src_thread.join()
+		dst_hashes = iter(dst_hashes)
+		for index, copied in batch:
+			self._copied_bytes[copied.method] = self._copied_bytes.get(copied.method, 0) + copied.size
+			if copied.pieces:
+				self._chunked.append((copied.src_path, copied.pieces))
+			dst_digests = [next(dst_hashes) for dst_path in copied.dst_paths]
+			self._verified_bytes += copied.size * len(copied.dst_paths)
+			warnings = list()
+			for dst_path, error in zip(copied.dst_paths, copied.errors):
+				if error:
+					warnings.append(f'Unable to copy {copied.src_path} to {dst_path}: {error}')
+			if copied.cache_mismatch:
+				warnings.append(f'{", ".join(copied.cache_mismatch)} of {copied.src_path} differ(s) from hash cache')
+			digests = {alg: getattr(copied, alg) for alg in self.src_algs}
+			self._file_row(index, copied.src_path, copied.dst_paths, copied.size, digests, dst_digests, warnings, row_queue)
+			for dst_path, (dst_md5, dst_sha256) in zip(copied.dst_paths, dst_digests):
+				if digests['md5'] and digests['md5'] == dst_md5 and digests['sha256'] == dst_sha256:
+					self.journal.add(copied.src_path, dst_path, digests)
+		self.journal.commit()
+		self._verify_seconds += perf_counter() - start_time
+		batch.clear()
+
+	def _verify_stage(self, verify_queue, row_queue):
+		'''Verify copied files in batches, pass directories and other objects through'''
+		batch = list()
+		batch_bytes = 0
+		while True:
+			try:
+				item = verify_queue.get(timeout=self.VERIFY_IDLE if batch else None)
+			except Empty:	# do not hold back results when source is slow
+				self._verify_batch(batch, row_queue)
+				batch_bytes = 0
+				continue
+			if not item:
+				break
+			index, tp, payload = item
+			if tp == 'failed':	# unexpected exception in copy worker, stop the pipeline
+				raise payload
+			if tp == 'journaled':	# copied and verified by an earlier run
+				src_path, dst_paths, size, digests = payload
+				dst_digests = [(digests['md5'], digests['sha256']) for dst_path in dst_paths]
+				self._file_row(index, src_path, dst_paths, size, digests, dst_digests, list(), row_queue)
+			elif tp == 'file':
+				batch.append((index, payload))
+				batch_bytes += payload.size
+				if len(batch) >= self.VERIFY_FILES or batch_bytes >= self.VERIFY_BYTES:
+					self._verify_batch(batch, row_queue)
+					batch_bytes = 0
+			else:
+				index, tp, src_path, dst_paths, size = payload
+				more_dsts = ''.join(f'\t{dst_path}\t-\t-' for dst_path in dst_paths[1:])
+				entry = self._relative(dst_paths[0]), tp, 0, ''
+				if tp == 'dir':
+					row_queue.put((index, tp, f'{src_path}\t{dst_paths[0]}\tdir\t-\t-\t-\t-{more_dsts}\tyes{self.no_flag}', True, '', None, entry))
+				else:
+					row_queue.put((index, tp, f'{src_path}\t{dst_paths[0]}\tother\t-\t-\t-\t-{more_dsts}\tno{self.no_flag}', False, '', None, entry))
+		if batch:
+			self._verify_batch(batch, row_queue)
+
+	def cp(self, sources, destinations, filename=None, outdir=None, cache=None, known=None, alert=None,
+			workers=None, resume=False, fast_size=None, chunked_size=None, physical=False, limit=None,
+			include=None, exclude=None, log=None):
+		'''Copy multiple sources in a pipeline: walk -> copy -> verify -> TSV,
+			every source file is read once and written to all destinations (one path or a list),
+			files of fast_size or more are copied by the kernel to one destination (default None = off),
+			the kernel does not give the data to hash, so these sources are read a second time,
+			files of chunked_size or more are copied to one destination in parallel pieces,
+			physical=True reads the files ordered by their position on disk (FIEMAP or inode),
+			limit sets the I/O bandwidth in MB/s, as number or list of "MB/S" and "PATH=MB/S" (device of PATH),
+			include/exclude are lists of glob or regex rules (PathFilter) that prune the walk of source directories
+		'''
+		self.fast_size = fast_size if fast_size else None
+		self.chunked_size = chunked_size if chunked_size else None
+		self.physical = physical
+		self.copy_window = self.PHYSICAL_WINDOW if self.physical else self.COPY_WINDOW
+		if isinstance(destinations, (list, tuple)):
+			self.dst_root_paths = list(dict.fromkeys(Path(destination) for destination in destinations))
+		else:
+			self.dst_root_paths = [Path(destinations)]
 		self.filename = TimeStamp.now_or(filename)
 		self.outdir = PathUtils.mkdir(outdir)
 		self.tsv_path = self.outdir / f'{self.filename}_files.tsv'
-		self.log = log if log else Logger(
-			filename=self.filename, outdir=self.outdir, head='hashedcopy.HashedCopy', echo=self.echo)
-		if self.dst_root_path.exists():
-			if not self.dst_root_path.is_dir():
-				self.log.error('Destination is not a directory')
+		self.tree_path = self.outdir / f'{self.filename}_tree.tsv'
+		self.journal_path = self.outdir / f'{self.filename}_journal.db'
+		self.log = log if log else Logger(filename=self.filename, outdir=self.outdir,	# keep log of the interrupted copy
+			head='hashedcopy.HashedCopy', echo=self.echo, append=resume)
+		if resume:
+			self.log.info('Resuming interrupted copy', echo=True)
+		if limit:
+			try:
+				limits = IoGovernor.set_limits(limit if isinstance(limit, (list, tuple)) else [limit])
+			except ValueError as ex:
+				self.log.error(f'Invalid I/O limit: {ex}')
+			self.log.info(f'Limiting I/O to {", ".join(limits)}', echo=True)
+		if self.fast_size:
+			self.log.info(f'Sources of {StringUtils.bytes(self.fast_size)} or more are copied by the kernel and read again to hash them', echo=True)
+		if include or exclude:
+			try:
+				self.prune = PathFilter(include=include, exclude=exclude)
+			except ValueError as ex:
+				self.log.error(f'Invalid filter rule {ex}')
+			self.pruned = PrunedList(self.outdir / f'{self.filename}_pruned.tsv')
+		else:
+			self.prune = self.pruned = None
+		self.resume = resume
+		if self.resume:
+			if not filename:
+				self.log.error('Resuming requires the filename of the interrupted copy')
+			if not self.journal_path.is_file():
+				self.log.error(f'Unable to resume, there is no journal {self.journal_path}')
+		self.journal = CopyJournal(self.journal_path, resume=self.resume)
+		for dst_root_path in self.dst_root_paths:
+			if dst_root_path.exists():
+				if not dst_root_path.is_dir():
+					self.log.error(f'Destination {dst_root_path} is not a directory')
+			else:
+				dst_root_path.mkdir()
+		self.cache = HashCache(cache, log=self.log) if cache else None
+		self.flags = HashFlags(known=known, alert=alert) if known or alert else None
+		if self.flags:
+			self.src_algs = ['md5', 'sha256'] + [alg for alg in self.flags.algorithms if not alg in ('md5', 'sha256')]
+			self.no_flag = '\t-'
 		else:
-			self.dst_root_path.mkdir()
+			self.src_algs = ['md5', 'sha256']
+			self.no_flag = ''
 		source_paths = sorted(list({Path(source) for source in sources}))
-		files2cp = list()
+		self.workers = workers if workers else DevUtils.default_workers(*source_paths)
+		self._pending = BoundedSemaphore(self.MAX_PENDING)
+		self._cancel = Event()	# set when a stage failed, walk and copy stop
+		self._pool = CopyPool(algorithms=self.src_algs, workers=self.workers, cache=self.cache,
+			fast_size=self.fast_size, chunked_size=self.chunked_size)
+		self._exceptions = list()
+		self._verified_bytes = 0
+		self._verify_seconds = 0
+		self._sync_seconds = 0
+		self._copied_bytes = dict()	# by copy method
+		self._chunked = list()	# (source, PieceHash)
+		self._journaled_cnt = 0
+		copy_queue = Queue(maxsize=self.copy_window)
+		verify_queue = Queue()	# bounded by MAX_PENDING
+		row_queue = Queue()
+		self.echo(f'Copying files to {len(self.dst_root_paths)} destination(s) using {self.workers} worker(s)')
+		stages = [
+			self._stage(self._walk_stage, source_paths, copy_queue),
+			self._stage(self._copy_stage, copy_queue, verify_queue),
+			self._stage(self._verify_stage, verify_queue, row_queue)
+		]
+		file_cnt = 0
 		error_cnt = 0
+		flag_cnts = {HashFlags.ALERT: 0, HashFlags.KNOWN: 0}
+		waiting = list()	# rows that are done before their predecessors
+		next_index = 0
+		tree = TreeDigest(self.tree_path)
+		def write_row(index, tp, line, success, flag, warnings, entry):
+			nonlocal file_cnt, error_cnt
+			print(line, file=fh)
+			tree.add(*entry)
+			if warnings:
+				for warning in warnings:
+					self.log.warning(warning)
+			if not success:
+				error_cnt += 1
+			elif tp == 'file':
+				file_cnt += 1
+				if file_cnt % self.PROGRESS_INTERVAL == 0:
+					self.echo(f'{file_cnt} file(s) copied and verified', end='\r')
+			if flag:
+				flag_cnts[flag] += 1
+			self._pending.release()
 		with self.tsv_path.open('w', encoding='utf-8') as fh:
-			print('Source\tDestination\tType\tSource_MD5\tDestination_MD5\tSource_SHA256\tDestination_SHA256\tSuccess', file=fh)
-			self.echo('Creating directories')
-			for source_path in source_paths:
-				root_dst_path = self.dst_root_path.joinpath(source_path)
-				if source_path.is_dir():
-					root_dst_path.mkdir(parents=True, exist_ok=True)
-					print(f'{source_path}\t{root_dst_path}\tdir\t-\t-\t-\t-\tyes', file=fh)
-					for abs_path, rel_path, tp in PathUtils.walk(source_path):
-						dst_path = self.dst_root_path.joinpath(source_path.name, rel_path)
-						if tp == 'dir':
-							dst_path.mkdir(parents=True, exist_ok=True)
-							print(f'{abs_path}\t{dst_path}\tdir\t-\t-\t-\t-\tyes', file=fh)
-						elif tp == 'file':
-							files2cp.append((abs_path, dst_path))
-						else:
-							print(f'{abs_path}\t{dst_path}\tother\t-\t-\t-\t-\tno', file=fh)
-							error_cnt += 1
-				elif source_path.is_file():
-					files2cp.append((source_path, root_dst_path))
-				else:
-					print(f'{source_path}\t{root_dst_path}\tother\t-\t-\t-\t-\tno', file=fh)
-					error_cnt += 1
-			self.echo('Copying files')
-			hashed_files = list()
-			progress = Progressor(len(files2cp), echo=self.echo, item='file')
-			for src_path, dst_path in files2cp:
-				src_hashes = CopyFile(src_path, dst_path)
-				hashed_files.append((src_path, dst_path, src_hashes))
-				progress.inc()
-			sync()
-			for src_path, dst_path, src_hashes in hashed_files:
-				dst_hashes = FileHashes(dst_path)
-				line = f'{src_path}\t{dst_path}\tfile\t{src_hashes.md5}\t{dst_hashes.md5}\t{src_hashes.sha256}\t{dst_hashes.sha256}\t'
-				if src_hashes.md5 == dst_hashes.md5 and src_hashes.sha256 == dst_hashes.sha256:
-					line += 'yes'
-				else:
-					line += 'no'
-					error_cnt += 1
-				print(line, file=fh)
-		self.log.info(f'Copied {len(hashed_files)-error_cnt} file(s), check {self.tsv_path}', echo=True)
+			head = 'Source\tDestination\tType\tSource_MD5\tDestination_MD5\tSource_SHA256\tDestination_SHA256'
+			for number in range(2, len(self.dst_root_paths) + 1):	# more destinations in additional columns
+				head += f'\tDestination_{number}\tDestination_{number}_MD5\tDestination_{number}_SHA256'
+			head += '\tSuccess'
+			print(f'{head}\tFlag' if self.flags else head, file=fh)
+			while row := row_queue.get():	# write rows in walk order as soon as they are complete
+				heappush(waiting, row)
+				while waiting and waiting[0][0] == next_index:
+					write_row(*heappop(waiting))
+					next_index += 1
+			while waiting:	# only left if a stage failed
+				write_row(*heappop(waiting))
+		if self._exceptions:	# nothing is written to the destinations after cp() has returned
+			self._cancel.set()
+			self._pool.cancel()
+		for stage in stages:	# the copy stage joins the copy workers
+			stage.join()
+		tree.close()
+		if self.pruned:
+			self.log.info(self.pruned.close(), echo=True)
+		if self._exceptions:
+			self.log.error(f'Copy pipeline failed: {self._exceptions[0]}', exception=False)
+		method = FileHash.UNCACHED_METHOD if FileHash.UNCACHED_METHOD else 'page cache, no bypass available'
+		throughput = StringUtils.bytes(self._verified_bytes / self._verify_seconds if self._verify_seconds else 0, format_k='{si}')
+		self.log.info(f'Verified {StringUtils.bytes(self._verified_bytes)} read back from {len(self.dst_root_paths)} destination(s) ({method}) in {self._verify_seconds:.1f} s, {throughput}/s', echo=True)
+		if self._copied_bytes:
+			methods = ', '.join(f'{StringUtils.bytes(size)} by {method}' for method, size in self._copied_bytes.items())
+			self.log.info(f'Copied {methods}', echo=True)
+			if twice := sum(self._copied_bytes.get(method, 0) for method in ('copy_file_range', 'sendfile')):
+				self.log.info(f'Read {StringUtils.bytes(twice)} of the sources twice (kernel copy and hash)', echo=True)
+		for src_path, pieces in self._chunked:
+			self.log.info(f'Merkle root of {len(pieces.digests)} {pieces.algorithm} piece digest(s) of {src_path}: {pieces.merkle_root}')
+		self.log.info(f'Waited {self._sync_seconds:.1f} s for the destination(s) to be written to disk', echo=True)
+		self.journal.close()
+		if self.resume:
+			self.log.info(f'Skipped {self._journaled_cnt} file(s) that have been copied and verified before', echo=True)
+		if self.cache:
+			self.cache.close()
+		if self.flags:
+			self.flags.close()
+			self.log.info(f'Flagged {flag_cnts[HashFlags.ALERT]} alert and {flag_cnts[HashFlags.KNOWN]} known file(s)', echo=True)
+		self.log.info(f'Tree digest ({tree.algorithm}) of the copied files: {tree.root}, check {self.tree_path}', echo=True)
+		self.log.info(f'Copied {file_cnt} file(s), check {self.tsv_path}', echo=True)
+		if self._exceptions:
+			raise self._exceptions[0]
 		if error_cnt > 0:
 			self.log.error(f'{error_cnt} missing file(s)')
 
+	def _listed(self, tsv_path):
+		'''Generate (type, destination, md5, sha256) for every destination in a TSV of an earlier copy'''
+		with tsv_path.open(encoding='utf-8') as fh:
+			head = fh.readline().rstrip('\n').split('\t')
+			try:
+				type_col = head.index('Type')
+				src_md5_col = head.index('Source_MD5')
+				src_sha256_col = head.index('Source_SHA256')
+			except ValueError:
+				self.log.error(f'{tsv_path} is not a file list of HashedCopy')
+			dst_cols = [col for col, name in enumerate(head) if name == 'Destination' or (
+				name.startswith('Destination_') and not name.endswith(('_MD5', '_SHA256')))]
+			for line in fh:
+				row = line.rstrip('\n').split('\t')
+				for col in dst_cols:
+					yield row[type_col], Path(row[col]), row[src_md5_col], row[src_sha256_col]
+
+	def verify(self, tsv, filename=None, outdir=None, workers=None, log=None):
+		'''Re-hash the destinations listed in the TSV of an earlier copy in parallel (one pass for md5 and sha256),
+			report missing, changed and extra files
+		'''
+		self.verify_path = Path(tsv)
+		self.filename = TimeStamp.now_or(filename, base='verify')
+		self.outdir = PathUtils.mkdir(outdir)
+		self.tsv_path = self.outdir / f'{self.filename}_verify.tsv'
+		self.log = log if log else Logger(
+			filename=self.filename, outdir=self.outdir, head='hashedcopy.HashedCopy', echo=self.echo)
+		if not self.verify_path.is_file():
+			self.log.error(f'Unable to read {self.verify_path}')
+		self.log.info(f'Verifying copy listed in {self.verify_path}', echo=True)
+		listed = ExternalSort(key=lambda line: Path(line.rsplit('\t', 1)[0]).parts)	# to find extra files in bounded memory
+		def files():
+			for tp, dst_path, md5, sha256 in self._listed(self.verify_path):
+				listed.add(f'{dst_path}\t{tp}')
+				if tp == 'file' and md5 and md5 != '-':	# skip files that have not been copied
+					yield dst_path, md5, sha256
+		cnts = {'ok': 0, 'missing': 0, 'changed': 0, 'unreadable': 0, 'extra': 0}
+		verified_bytes = 0
+		start_time = perf_counter()
+		with self.tsv_path.open('w', encoding='utf-8') as fh:
+			print('Path\tStatus\tExpected_MD5\tMD5\tExpected_SHA256\tSHA256', file=fh)
+			expected, hashed = tee(files())
+			dst_hashes = HashPool(algorithms=['md5', 'sha256'], workers=workers, uncached=True).map(
+				dst_path for dst_path, md5, sha256 in hashed)
+			for (dst_path, md5, sha256), (dst_md5, dst_sha256) in zip(expected, dst_hashes):
+				if md5 == dst_md5 and sha256 == dst_sha256:
+					cnts['ok'] += 1
+					verified_bytes += dst_path.stat().st_size
+					if cnts['ok'] % self.PROGRESS_INTERVAL == 0:
+						self.echo(f'{cnts["ok"]} file(s) verified', end='\r')
+					continue
+				if not dst_md5:
+					status = 'unreadable' if dst_path.exists() else 'missing'
+				else:
+					status = 'changed'
+				cnts[status] += 1
+				print(f'{dst_path}\t{status}\t{md5}\t{dst_md5}\t{sha256}\t{dst_sha256}', file=fh)
+			with TemporaryFile('w+', encoding='utf-8') as listed_fh:	# sorted by path parts as the walk gives them
+				for line in listed.sorted():
+					print(line, file=listed_fh)
+				listed_fh.seek(0)
+				roots = list()	# listed directories that are not inside other listed directories
+				for line in listed_fh:
+					dst_path, tp = line.rstrip('\n').rsplit('\t', 1)
+					parts = Path(dst_path).parts
+					if tp == 'dir' and not (roots and parts[:len(roots[-1])] == roots[-1]):
+						roots.append(parts)
+				listed_fh.seek(0)
+				listed_items = ((Path(dst_path).parts, dst_path) for dst_path, tp in (
+					line.rstrip('\n').rsplit('\t', 1) for line in listed_fh))
+				walked_items = ((path.parts, f'{path}')
+					for root in roots for path, relative, tp in PathUtils.walk(Path(*root)))
+				for parts, difference, dst_path, path in ExternalSort.diff(listed_items, walked_items):
+					if difference == 'only_b':
+						cnts['extra'] += 1
+						print(f'{path}\textra\t-\t-\t-\t-', file=fh)
+		seconds = perf_counter() - start_time
+		throughput = StringUtils.bytes(verified_bytes / seconds if seconds else 0, format_k='{si}')
+		self.log.info(f'Verified {cnts["ok"]} file(s), {StringUtils.bytes(verified_bytes)} in {seconds:.1f} s, {throughput}/s', echo=True)
+		problems = ', '.join(f'{cnt} {status}' for status, cnt in cnts.items() if cnt and status != 'ok')
+		if problems:
+			self.log.warning(f'Found {problems} file(s), check {self.tsv_path}')
+		else:
+			self.log.info('Copy is unchanged, no missing or extra files', echo=True)
+
 
 class HashedCopyCli(ArgumentParser):
 	'''CLI for the copy tool'''
@@ -99,16 +510,55 @@ class HashedCopyCli(ArgumentParser):
 	def __init__(self, echo=print):
 		'''Define CLI using argparser'''
 		super().__init__(description=__description__.strip(), prog=__app_name__.lower())
-		self.add_argument('-d', '--destination', type=Path, required=True,
-			help='Destination root (required)', metavar='DIRECTORY'
+		self.add_argument('-c', '--cache', type=Path, nargs='?', const=HashCache.DEFAULT_PATH,
+			help=f'Use persistent hash cache (default: {HashCache.DEFAULT_PATH})', metavar='FILE'
+		)
+		self.add_argument('-d', '--destination', type=Path, action='append',
+			help='Destination root (required to copy), give multiple times to write all copies from one read', metavar='DIRECTORY'
+		)
+		self.add_argument('-e', '--fast', type=int, nargs='?', const=CopyFile.FAST_SIZE,
+			help=f'Let the kernel copy files of at least this size (default: {CopyFile.FAST_SIZE}), the sources are read twice to hash them',
+			metavar='BYTES'
 		)
 		self.add_argument('-f', '--filename', type=str,
 			help='Filename to generated (without extension)', metavar='STRING'
 		)
+		self.add_argument('-i', '--include', type=str, action='append',
+			help='Copy only files matching glob or regex (prefix "re:"), can be given multiple times', metavar='RULE'
+		)
+		self.add_argument('-k', '--known', type=Path, action='append',
+			help='Index file (built by HashIndexer) with hashes of known files, can be given multiple times', metavar='FILE'
+		)
+		self.add_argument('-l', '--limit', type=str, action='append',
+			help='Limit I/O bandwidth per device, PATH=MB/S only limits the device holding PATH, can be given multiple times (default: no limit)',
+			metavar='MB/S|PATH=MB/S'
+		)
+		self.add_argument('-n', '--chunked', type=int,
+			help=f'Copy files of at least this size in parallel pieces of {PieceHash.PIECE_SIZE // 1048576} MiB (pread/pwrite)',
+			metavar='BYTES'
+		)
 		self.add_argument('-o', '--outdir', type=Path,
 			help='Directory to write log and file list (default: current)', metavar='DIRECTORY'
 		)
-		self.add_argument('sources', nargs='+', type=Path,
+		self.add_argument('-r', '--resume', default=False, action='store_true',
+			help='Resume interrupted copy with the same filename and outdir (skip files in journal)'
+		)
+		self.add_argument('-s', '--physical', default=False, action='store_true',
+			help='Read files in the order of their position on the source disk (for spinning disks)'
+		)
+		self.add_argument('-u', '--exclude', type=str, action='append',
+			help='Skip files and directories matching glob or regex (prefix "re:"), can be given multiple times', metavar='RULE'
+		)
+		self.add_argument('-v', '--verify', type=Path,
+			help='Re-hash the destination files listed in the TSV of an earlier copy (no sources needed)', metavar='FILE'
+		)
+		self.add_argument('-w', '--workers', type=int,
+			help='Number of parallel copy or verify workers (default: 1 for rotational disks, more for SSD/NVMe)', metavar='INTEGER'
+		)
+		self.add_argument('-x', '--alert', type=Path, action='append',
+			help='Index file (built by HashIndexer) with hashes to alert on, can be given multiple times', metavar='FILE'
+		)
+		self.add_argument('sources', nargs='*', type=Path,
 			help='Source files or directories to copy', metavar='FILE/DIRECTORY'
 		)
 		self.echo = echo
@@ -116,17 +566,50 @@ class HashedCopyCli(ArgumentParser):
 	def parse(self, *cmd):
 		'''Parse arguments'''
 		args = super().parse_args(*cmd)
+		self.verify = args.verify
+		if not self.verify and (not args.destination or not args.sources):
+			self.error('the arguments -d/--destination and sources are required to copy')
 		self.sources = args.sources
-		self.destination = args.destination
+		self.cache = args.cache
+		self.known = args.known
+		self.alert = args.alert
+		self.workers = args.workers
+		self.resume = args.resume
+		self.fast = args.fast
+		self.chunked = args.chunked
+		self.physical = args.physical
+		self.limit = args.limit
+		self.include = args.include
+		self.exclude = args.exclude
+		self.destinations = args.destination
 		self.filename = args.filename
 		self.outdir = args.outdir
 
 	def run(self):
 		'''Run the tool'''
 		copy = HashedCopy(echo=self.echo)
-		copy.cp(self.sources, self.destination,
+		if self.verify:
+			copy.verify(self.verify,
+				filename = self.filename,
+				outdir = self.outdir,
+				workers = self.workers
+			)
+			copy.log.close()
+			return
+		copy.cp(self.sources, self.destinations,
 			filename = self.filename,
-			outdir = self.outdir
+			outdir = self.outdir,
+			cache = self.cache,
+			known = self.known,
+			alert = self.alert,
+			workers = self.workers,
+			resume = self.resume,
+			fast_size = self.fast,
+			chunked_size = self.chunked,
+			physical = self.physical,
+			limit = self.limit,
+			include = self.include,
+			exclude = self.exclude
 		)
 		copy.log.close()
 
@@ -18,6 +18,9 @@ from lib.pathutils import PathUtils
 from lib.timestamp import TimeStamp
 from lib.logger import Logger
 from lib.hashes import FileHash, HashThread
+from lib.devutils import DevUtils
+from lib.hashcache import HashCache
+from lib.hashindex import HashFlags
 from lib.winutils import RoboCopy
 
 class HashedRoboCopy:
@@ -47,7 +50,8 @@ class HashedRoboCopy:
 		else:
 			self.log.info(f'Robocopy.exe finished with returncode {returncode}', echo=True)
 
-	def copy(self, sources, destination=None, filename=None, outdir=None, hashes=['md5'], log=None):
+	def copy(self, sources, destination=None, filename=None, outdir=None, hashes=['md5'],
+			workers=None, processes=False, cache=None, known=None, alert=None, log=None):
 		'''Copy multiple sources'''
 		available_algs = FileHash.get_algorithms()
 		self.hash_algs = None if not hashes or 'none' in hashes else [alg for alg in hashes if alg in available_algs]
@@ -57,6 +61,11 @@ class HashedRoboCopy:
 		self.log = log if log else Logger(
 			filename=self.filename, outdir=self.outdir, head='hashedrobocopy.HashedRoboCopy', echo=self.echo)
 		self.warnings = 0
+		self.flags = HashFlags(known=known, alert=alert) if known or alert else None
+		if self.flags:	# flagging needs the algorithms of the indexes
+			if not self.hash_algs:
+				self.hash_algs = list()
+			self.hash_algs += [alg for alg in self.flags.algorithms if not alg in self.hash_algs]
 		src_files = set()
 		src_dirs = set()
 		for source in sources:
@@ -96,8 +105,12 @@ class HashedRoboCopy:
 				else:
 					self.log.warning(f'{path} is neither a file nor a directory and will be ignored')
 		if self.hash_algs:
-			self.log.info(f'Start calculating hashe(s) for {len(self.files)} file(s)', echo=True)
-			hash_thread = HashThread((tpl[0] for tpl in self.files), algorithms=self.hash_algs)
+			if not workers:
+				workers = DevUtils.default_workers(*src_files, *src_dirs)
+			self.log.info(f'Start calculating hashe(s) for {len(self.files)} file(s) using {workers} worker(s)', echo=True)
+			self.cache = HashCache(cache, log=self.log) if cache else None
+			hash_thread = HashThread((tpl[0] for tpl in self.files), algorithms=self.hash_algs,
+				workers=workers, processes=processes, cache=self.cache)
 			hash_thread.start()
 		if self.destination:
 			for src_path in src_dirs:
@@ -116,8 +129,14 @@ class HashedRoboCopy:
 		head = 'Source\tType/File Size'
 		if self.hash_algs:
 			self.hashes = hash_thread.wait(echo=self.echo)
+			if self.cache:
+				self.cache.close()
 			head += f'\t{"\t".join(self.hash_algs)}'
 			cols2add = '\t-' * len(self.hash_algs)
+			if self.flags:
+				head += '\tFlag'
+				cols2add += '\t-'
+				flag_cnts = {HashFlags.ALERT: 0, HashFlags.KNOWN: 0}
 		else:
 			cols2add = ''
 		with self.tsv_path.open('w', encoding='utf-8') as fh:
@@ -129,10 +148,20 @@ class HashedRoboCopy:
 					line = f'{src_path}\t{size}'
 					for hash in hashes:
 						line += f'\t{hash}'
+					if self.flags:
+						flag = self.flags.flag(dict(zip(self.hash_algs, hashes)))
+						if flag:
+							flag_cnts[flag] += 1
+							if flag == HashFlags.ALERT:
+								self.log.warning(f'Hash of {src_path} is in alert list')
+						line += f'\t{flag}'
 					print(line, file=fh)
 			else:
 				for src_path, rel_path, size in self.files:
 					print(f'{src_path}\t{size}', file=fh)
+		if self.flags:
+			self.flags.close()
+			self.log.info(f'Flagged {flag_cnts[HashFlags.ALERT]} alert and {flag_cnts[HashFlags.KNOWN]} known file(s)', echo=True)
 		if self.destination:
 			for src_path, rel_path, size in self.files:
 				dst_path = self.destination / rel_path
@@ -156,15 +185,30 @@ class HashedRoboCopyCli(ArgumentParser):
 			help=f'''Algorithms to hash seperated by colon (e.g. "md5,sha256", no hashing: "none", default: "md5",
 available algorithms: {', '.join(FileHash.get_algorithms())})''', metavar='STRING'
 		)
+		self.add_argument('-c', '--cache', type=Path, nargs='?', const=HashCache.DEFAULT_PATH,
+			help=f'Use persistent hash cache (default: {HashCache.DEFAULT_PATH})', metavar='FILE'
+		)
 		self.add_argument('-d', '--destination', type=Path,
 			help='Destination root (only calculate hashes if no destination is given)', metavar='DIRECTORY'
 		)
 		self.add_argument('-f', '--filename', type=str,
 			help='Filename to generate for log and file list (without extension)', metavar='STRING'
 		)
+		self.add_argument('-k', '--known', type=Path, action='append',
+			help='Index file (built by HashIndexer) with hashes of known files, can be given multiple times', metavar='FILE'
+		)
 		self.add_argument('-o', '--outdir', type=Path,
 			help='Directory to write log and file list (default: current)', metavar='DIRECTORY'
 		)
+		self.add_argument('-p', '--processes', default=False, action='store_true',
+			help='Use processes instead of threads to calculate hashes'
+		)
+		self.add_argument('-w', '--workers', type=int,
+			help='Number of parallel hash workers (default: 1 for rotational disks, more for SSD/NVMe)', metavar='INTEGER'
+		)
+		self.add_argument('-x', '--alert', type=Path, action='append',
+			help='Index file (built by HashIndexer) with hashes to alert on, can be given multiple times', metavar='FILE'
+		)
 		self.add_argument('sources', nargs='+', type=Path,
 			help='Source files or directories to copy', metavar='FILE/DIRECTORY'
 		)
@@ -175,9 +219,14 @@ available algorithms: {', '.join(FileHash.get_algorithms())})''', metavar='STRIN
 		args = super().parse_args(*cmd)
 		self.sources = args.sources
 		self.algorithms = FileHash.parse_algorithms(args.algorithms)
+		self.cache = args.cache
+		self.known = args.known
+		self.alert = args.alert
 		self.destination = args.destination
 		self.filename = args.filename
 		self.outdir = args.outdir
+		self.processes = args.processes
+		self.workers = args.workers
 
 	def run(self):
 		'''Run the tool'''
@@ -186,7 +235,12 @@ available algorithms: {', '.join(FileHash.get_algorithms())})''', metavar='STRIN
 			destination = self.destination,
 			filename = self.filename,
 			outdir = self.outdir,
-			hashes = self.algorithms
+			hashes = self.algorithms,
+			workers = self.workers,
+			processes = self.processes,
+			cache = self.cache,
+			known = self.known,
+			alert = self.alert
 		)
 		hrc.log.close()
 
@@ -1,14 +1,52 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from hashlib import algorithms_available, file_digest
-from threading import Thread
+from hashlib import algorithms_available, new as new_hash
+from threading import Thread, local, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
 from time import sleep
+from os import fstat
 from pathlib import Path
+from .devutils import DevUtils
+from .iogovernor import IoGovernor
+try:
+	from os import posix_fadvise, POSIX_FADV_DONTNEED
+except ImportError:	# not on Windows
+	posix_fadvise = None
+try:
+	from os import pread, pwrite
+except ImportError:
+	pread = pwrite = None
+
+class MultiHash:
+	'''Feed the same data into multiple hash algorithms'''
+
+	SHAKE_LENGTHS = {'shake_128': 32, 'shake_256': 64}	# variable length digests need a fixed length
+
+	def __init__(self, algorithms=['md5']):
+		'''Generate one hashlib object for each algorithm'''
+		self.algorithms = list(algorithms)
+		self._hashes = [new_hash(alg) for alg in self.algorithms]
+
+	def update(self, data):
+		'''Update all hashes with the same data (bytes, bytearray or memoryview)'''
+		for hash in self._hashes:
+			hash.update(data)
+
+	def hexdigests(self):
+		'''Return list of hex digests in the order of the algorithms'''
+		return [
+			hash.hexdigest(self.SHAKE_LENGTHS[alg]) if alg in self.SHAKE_LENGTHS else hash.hexdigest()
+			for alg, hash in zip(self.algorithms, self._hashes)
+		]
 
 class FileHash:
 	'''Calculate hashes of files'''
 
+	BLOCK_SIZE = 1048576	# 1 MiB
+	UNCACHED_METHOD = 'posix_fadvise DONTNEED' if posix_fadvise else None
+
 	@staticmethod
 	def get_algorithms():
 		'''Get list of available algorithms'''
@@ -26,30 +64,295 @@ class FileHash:
 				if not alg_lower in algorithms_available:
 					raise ValueError(f'Algorithm {alg} is not available with hashlib')
 				algs.append(alg_lower)
+			return algs
 		else:
 			return ['md5']
 
+	@staticmethod
+	def new_buffer(block_size=None):
+		'''Preallocate buffer to be reused for reading files'''
+		return bytearray(block_size if block_size else FileHash.BLOCK_SIZE)
+
+	@staticmethod
+	def hashsums(path, algorithms=['md5'], buffer=None, uncached=False, cache=None):
+		'''Calculate hashes of one file using multiple algorithms by reading the file only once,
+			uncached=True evicts the (synced) file from the page cache to read it from the medium,
+			cache=HashCache() gives digests of unchanged files without reading them
+		'''
+		if cache:
+			identity = cache.identity(path)
+			digests = cache.get(path, identity, algorithms)
+			missing = [alg for alg in algorithms if not alg in digests]
+			if missing:
+				digests.update(zip(missing, FileHash.hashsums(path, algorithms=missing, buffer=buffer, uncached=uncached)))
+				cache.put(path, identity, {alg: digests[alg] for alg in missing})
+			return [digests[alg] for alg in algorithms]
+		if buffer is None:
+			buffer = FileHash.new_buffer()
+		view = memoryview(buffer)
+		uncached = uncached and posix_fadvise
+		try:
+			multi = MultiHash(algorithms)
+			with Path(path).open('rb', buffering=0) as fh:
+				device = fstat(fh.fileno()).st_dev
+				if uncached:
+					fd = fh.fileno()
+					posix_fadvise(fd, 0, 0, POSIX_FADV_DONTNEED)
+					offset = 0
+				while size := fh.readinto(buffer):
+					IoGovernor.draw(device, size)
+					multi.update(view[:size])
+					if uncached:	# do not fill the cache while reading
+						posix_fadvise(fd, offset, size, POSIX_FADV_DONTNEED)
+						offset += size
+			return multi.hexdigests()
+		except:
+			return ['' for alg in algorithms]
+
 	@staticmethod
 	def hashsum(path, algorithm='md5'):
 		'''Calculate hash of one file'''
+		return FileHash.hashsums(path, algorithms=[algorithm])[0]
+
+class FileHashes:
+	'''Hashes of one file as attributes, e.g. FileHashes(path).sha256'''
+
+	def __init__(self, path, algorithms=['md5', 'sha256']):
+		'''Calculate all hashes in one pass'''
+		self.path = path
+		self.algorithms = list(algorithms)
+		for alg, digest in zip(self.algorithms, FileHash.hashsums(path, algorithms=self.algorithms)):
+			setattr(self, alg, digest)
+
+	def __str__(self):
+		'''One line per algorithm'''
+		return '\n'.join(f'{alg}: {getattr(self, alg)}' for alg in self.algorithms)
+
+_worker_local = local()	# one read buffer per pool thread or process
+
+def _pooled_hashsums(path, algorithms, uncached, cache):
+	'''Calculate hashes inside a pool worker'''
+	try:
+		buffer = _worker_local.buffer
+	except AttributeError:
+		buffer = _worker_local.buffer = FileHash.new_buffer()
+	return FileHash.hashsums(path, algorithms=algorithms, buffer=buffer, uncached=uncached, cache=cache)
+
+class HashPool:
+	'''Calculate hashes of many files with parallel workers, results are given in input order'''
+
+	IN_FLIGHT_PER_WORKER = 4
+	IN_FLIGHT_PER_DEVICE_POOL = 32	# used when there is one reader per device
+
+	def __init__(self, algorithms=['md5'], workers=None, processes=False, in_flight=None,
+			per_device=False, uncached=False, cache=None):
+		'''Workers=None chooses the number by the device of the first file,
+			per_device=True uses one reader thread for each device instead,
+			the HashCache can only be shared by threads, not by processes
+		'''
+		self.algorithms = list(algorithms)
+		self.workers = workers
+		self.processes = processes
+		self.in_flight = in_flight
+		self.per_device = per_device
+		self.uncached = uncached
+		self.cache = cache
+
+	def map(self, paths):
+		'''Generator to get hashes of the given paths in the same order'''
+		paths = iter(paths)
 		try:
-			with path.open('rb') as fh:
-				return file_digest(fh, algorithm).hexdigest()
-		except:
-			return ''
+			first_path = next(paths)
+		except StopIteration:
+			return
+		if self.per_device:
+			executors = dict()
+			def submit(path):
+				device = DevUtils.device_id(path)
+				if not device in executors:
+					executors[device] = ThreadPoolExecutor(max_workers=1)
+				return executors[device].submit(_pooled_hashsums, path, self.algorithms, self.uncached, self.cache)
+			in_flight = self.in_flight if self.in_flight else self.IN_FLIGHT_PER_DEVICE_POOL
+		else:
+			workers = self.workers if self.workers else DevUtils.default_workers(first_path)
+			Executor = ProcessPoolExecutor if self.processes and not self.cache else ThreadPoolExecutor
+			executors = {None: Executor(max_workers=workers)}
+			submit = lambda path: executors[None].submit(_pooled_hashsums, path, self.algorithms, self.uncached, self.cache)
+			in_flight = self.in_flight if self.in_flight else workers * self.IN_FLIGHT_PER_WORKER
+		try:
+			futures = deque([submit(first_path)])
+			for path in paths:
+				if len(futures) >= in_flight:
+					yield futures.popleft().result()
+				futures.append(submit(path))
+			while futures:
+				yield futures.popleft().result()
+		finally:
+			for executor in executors.values():
+				executor.shutdown()
+
+class PieceHash:
+	'''Hash fixed size pieces of one large file in parallel, build a Merkle root and the full file hashes'''
+
+	PIECE_SIZE = 67108864	# 64 MiB
+	PIECE_ALGORITHM = 'sha256'
+	MAX_PIECES = DevUtils.SOLID_STATE_WORKERS + 1	# pieces in memory for all files together (parallel copies)
+	_budget = BoundedSemaphore(MAX_PIECES)
+
+	@staticmethod
+	def read_range(fh, offset, size):
+		'''Positional read from opened file (pread is thread safe, seek is only used on Windows)'''
+		if not pread:
+			with open(fh.name, 'rb', buffering=0) as this_fh:
+				this_fh.seek(offset)
+				return this_fh.read(size)
+		data = pread(fh.fileno(), size, offset)
+		while len(data) < size:
+			more = pread(fh.fileno(), size - len(data), offset + len(data))
+			if not more:
+				break
+			data += more
+		return data
+
+	@staticmethod
+	def write_range(fh, offset, data):
+		'''Positional write to opened file (pwrite is thread safe, seek is only used on Windows)'''
+		if not pwrite:
+			with open(fh.name, 'r+b', buffering=0) as this_fh:
+				this_fh.seek(offset)
+				this_fh.write(data)
+			return
+		view = memoryview(data)
+		written = 0
+		while written < len(view):
+			written += pwrite(fh.fileno(), view[written:], offset + written)
+
+	@staticmethod
+	def build_merkle_root(digests, algorithm=PIECE_ALGORITHM):
+		'''Build root of binary hash tree from piece digests (bytes), an odd digest is passed up'''
+		if not digests:
+			return new_hash(algorithm).hexdigest()
+		level = list(digests)
+		while len(level) > 1:
+			level = [
+				new_hash(algorithm, level[i] + level[i+1]).digest() if i + 1 < len(level) else level[i]
+				for i in range(0, len(level), 2)
+			]
+		return level[0].hex()
+
+	@staticmethod
+	def sidecar(path):
+		'''Default path of the file listing the piece digests'''
+		return Path(path).with_name(f'{Path(path).name}.pieces.tsv')
+
+	def __init__(self, path, piece_size=None, algorithm=None, workers=None):
+		'''Workers=None chooses the number by the device holding the file'''
+		self.path = Path(path)
+		self.piece_size = piece_size if piece_size else self.PIECE_SIZE
+		self.algorithm = algorithm if algorithm else self.PIECE_ALGORITHM
+		self.workers = workers if workers else DevUtils.default_workers(self.path)
+
+	def _hash_piece(self, fh, offset, keep, dst_fh=None):
+		'''Read and hash one piece, return digest and data if data is needed for the full file hashes'''
+		data = self.read_range(fh, offset, self.piece_size)
+		IoGovernor.draw(self._device, len(data))
+		if dst_fh:
+			self.write_range(dst_fh, offset, data)
+			IoGovernor.draw(self._dst_device, len(data))
+		return new_hash(self.algorithm, data).digest(), data if keep else None
+
+	def _pieces(self, offsets, keep, dst_fh=None):
+		'''Generator to get (offset, digest, data) in file order while workers read ahead'''
+		with (
+			self.path.open('rb', buffering=0) as fh,
+			ThreadPoolExecutor(max_workers=self.workers) as executor
+		):
+			self._device = fstat(fh.fileno()).st_dev
+			self._dst_device = fstat(dst_fh.fileno()).st_dev if dst_fh else None
+			futures = deque()
+			held = 0	# pieces taken from the shared budget
+			def oldest():
+				offset, future = futures.popleft()
+				return offset, *future.result()
+			try:
+				for offset in offsets:	# limit memory to workers + 1 pieces and to the shared budget
+					while futures and (len(futures) > self.workers or not PieceHash._budget.acquire(blocking=False)):
+						yield oldest()
+						PieceHash._budget.release()
+						held -= 1
+					if not futures:	# nothing to give back, wait for other files
+						PieceHash._budget.acquire()
+					held += 1
+					futures.append((offset, executor.submit(self._hash_piece, fh, offset, keep, dst_fh)))
+				while futures:
+					yield oldest()
+					PieceHash._budget.release()
+					held -= 1
+			finally:
+				for piece in range(held):
+					PieceHash._budget.release()
+
+	def calculate(self, algorithms=['md5', 'sha256'], dst_fh=None):
+		'''Hash pieces in parallel and feed them in order into the full file hashes'''
+		self.size = self.path.stat().st_size
+		self.digests = list()
+		multi = MultiHash(algorithms)
+		for offset, digest, data in self._pieces(range(0, self.size, self.piece_size), True, dst_fh=dst_fh):
+			self.digests.append(digest)
+			multi.update(data)
+		self.merkle_root = self.build_merkle_root(self.digests, algorithm=self.algorithm)
+		return multi.hexdigests()
+
+	def copy(self, dst_fh, algorithms=['md5', 'sha256']):
+		'''Copy pieces in parallel into opened destination file by positional writes, return full file hashes'''
+		dst_fh.truncate(self.path.stat().st_size)
+		return self.calculate(algorithms=algorithms, dst_fh=dst_fh)
+
+	def write(self, sidecar_path=None):
+		'''Write piece digests and Merkle root as TSV'''
+		self.sidecar_path = Path(sidecar_path) if sidecar_path else self.sidecar(self.path)
+		with self.sidecar_path.open('w', encoding='utf-8') as fh:
+			print(f'Offset\tSize\t{self.algorithm}', file=fh)
+			for index, digest in enumerate(self.digests):
+				offset = index * self.piece_size
+				print(f'{offset}\t{min(self.piece_size, self.size - offset)}\t{digest.hex()}', file=fh)
+			print(f'merkle_root\t{self.size}\t{self.merkle_root}', file=fh)
+		return self.sidecar_path
+
+	def verify(self, sidecar_path=None):
+		'''Re-hash pieces listed in sidecar file, return damaged ranges as list of (offset, size)'''
+		sidecar_path = Path(sidecar_path) if sidecar_path else self.sidecar(self.path)
+		expected = dict()
+		with sidecar_path.open(encoding='utf-8') as fh:
+			self.algorithm = fh.readline().strip().split('\t')[2]
+			for line in fh:
+				offset, size, digest = line.strip().split('\t')
+				if offset == 'merkle_root':
+					self.size = int(size)
+				else:
+					expected[int(offset)] = int(size), digest
+		if expected:
+			self.piece_size = expected[0][0]
+		damaged = list()
+		for offset, digest, data in self._pieces(sorted(expected), False):
+			if digest.hex() != expected[offset][1]:
+				damaged.append((offset, expected[offset][0]))
+		if self.path.stat().st_size != self.size:
+			damaged.append((min(self.size, self.path.stat().st_size), abs(self.path.stat().st_size - self.size)))
+		return damaged
 
 class HashThread(Thread):
-	'''Calculate hashes of files in thread'''
+	'''Calculate hashes of files in thread using HashPool'''
 
-	def __init__(self, paths, algorithms=['md5']):
-		'''Generate object to calculate hashes of files using multiprocessing pool'''
+	def __init__(self, paths, algorithms=['md5'], workers=None, processes=False, cache=None):
+		'''Generate object to calculate hashes of files using a pool of workers'''
 		super().__init__()
 		self._paths = paths
-		self._algs = algorithms
+		self._pool = HashPool(algorithms=algorithms, workers=workers, processes=processes, cache=cache)
 
 	def run(self):
-		'''Calculate all hashes (multiple algorithms) in parallel - this method launches the worker'''
-		self.hashes = [[FileHash.hashsum(path, algorithm=alg) for alg in self._algs] for path in self._paths]
+		'''Calculate all hashes (multiple algorithms) in parallel - this method launches the workers'''
+		self.hashes = list(self._pool.map(self._paths))
 
 	def wait(self, echo=print):
 		'''Wait for worker to finish and return results'''
@@ -61,4 +364,4 @@ class HashThread(Thread):
 				sleep(.25)
 				index = index + 1 if index < 3 else 0
 		self.join()
-		return self.hashes
\ No newline at end of file
+		return self.hashes
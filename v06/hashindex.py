@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from heapq import merge
+from tempfile import TemporaryDirectory
+from math import log as ln
+from re import compile as re_compile
+from pathlib import Path
+
+class HashIndex:
+	'''Sorted binary index of digests, memory mapped for lookups with optional Bloom prefilter'''
+
+	MAGIC = b'FIHASHIX'
+	HEADER = Struct('<8s16sIQQI')	# magic, algorithm, digest size, count, Bloom filter bytes, Bloom hashes
+	DIGEST_SIZES = {16: 'md5', 20: 'sha1', 32: 'sha256', 64: 'sha512'}
+	CHUNK_SIZE = 4000000	# digests to sort in memory when compiling
+	BLOOM_BITS = 10	# bits per digest, gives < 1% false positives
+	SPLIT = re_compile(r'[\s,;|]+')
+
+	@staticmethod
+	def _bloom_positions(digest, bits, hashes):
+		'''Derive bit positions from the digest itself (digests are uniformly distributed)'''
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:16], 'little') | 1
+		return ((h1 + i * h2) % bits for i in range(hashes))
+
+	@staticmethod
+	def _parse(line, hex_len):
+		'''Get first field that looks like a digest of the given length, None if there is none'''
+		for field in HashIndex.SPLIT.split(line):
+			field = field.strip('"\'')
+			if len(field) == hex_len:
+				try:
+					return bytes.fromhex(field)
+				except ValueError:
+					continue
+
+	@staticmethod
+	def compile(sources, index_path, algorithm='md5', bloom_bits=None, echo=print):
+		'''Compile text files (one digest per line or CSV/TSV like NSRL) into index file using
+			sorted runs on disk, so memory usage does not depend on the size of the lists
+		'''
+		sizes = {alg: size for size, alg in HashIndex.DIGEST_SIZES.items()}
+		if not algorithm in sizes:
+			raise ValueError(f'Algorithm {algorithm} is not supported by HashIndex')
+		digest_size = sizes[algorithm]
+		bloom_bits = HashIndex.BLOOM_BITS if bloom_bits is None else bloom_bits
+		with TemporaryDirectory() as tmp_dir:
+			runs = list()
+			chunk = list()
+			total = 0
+			def write_run():
+				run_path = Path(tmp_dir) / f'{len(runs)}.run'
+				with run_path.open('wb') as fh:
+					for digest in sorted(chunk):
+						fh.write(digest)
+				runs.append(run_path)
+				chunk.clear()
+			for source in sources:
+				echo(f'Reading {source}')
+				with Path(source).open(encoding='utf-8', errors='ignore') as fh:
+					for line in fh:
+						if digest := HashIndex._parse(line, digest_size * 2):
+							chunk.append(digest)
+							total += 1
+							if len(chunk) >= HashIndex.CHUNK_SIZE:
+								write_run()
+			if chunk:
+				write_run()
+			echo(f'Merging {total} digest(s) from {len(runs)} sorted run(s)')
+			bloom_size = (total * bloom_bits + 7) // 8
+			bits = bloom_size * 8
+			bloom_hashes = max(1, round(bloom_bits * ln(2))) if bloom_size else 0
+			bloom = bytearray(bloom_size)
+			def read_run(path):
+				with path.open('rb') as fh:
+					while digest := fh.read(digest_size):
+						yield digest
+			count = 0
+			previous = None
+			with Path(index_path).open('wb') as fh:
+				fh.write(bytes(HashIndex.HEADER.size + bloom_size))	# placeholder
+				for digest in merge(*(read_run(path) for path in runs)):
+					if digest == previous:
+						continue
+					fh.write(digest)
+					if bloom_size:
+						for pos in HashIndex._bloom_positions(digest, bits, bloom_hashes):
+							bloom[pos >> 3] |= 1 << (pos & 7)
+					previous = digest
+					count += 1
+				fh.seek(0)
+				fh.write(HashIndex.HEADER.pack(HashIndex.MAGIC, algorithm.encode(), digest_size, count, bloom_size, bloom_hashes))
+				fh.write(bloom)
+		return count
+
+	def __init__(self, index_path):
+		'''Open and memory map index file'''
+		self.path = Path(index_path)
+		self._fh = self.path.open('rb')
+		self._mm = mmap(self._fh.fileno(), 0, access=ACCESS_READ)
+		magic, algorithm, self.digest_size, self.count, self.bloom_size, self.bloom_hashes = self.HEADER.unpack_from(self._mm)
+		if magic != self.MAGIC:
+			raise ValueError(f'{self.path} is not a hash index file')
+		self.algorithm = algorithm.rstrip(b'\0').decode()
+		self._bloom_offset = self.HEADER.size
+		self._bloom_bits = self.bloom_size * 8
+		self._records_offset = self.HEADER.size + self.bloom_size
+
+	def _in_bloom(self, digest):
+		'''Check Bloom filter, False means digest is definitely not in index'''
+		for pos in self._bloom_positions(digest, self._bloom_bits, self.bloom_hashes):
+			if not self._mm[self._bloom_offset + (pos >> 3)] & (1 << (pos & 7)):
+				return False
+		return True
+
+	def __contains__(self, digest):
+		'''Look up digest given as hex string or bytes by binary search'''
+		if isinstance(digest, str):
+			try:
+				digest = bytes.fromhex(digest)
+			except ValueError:
+				return False
+		if len(digest) != self.digest_size:
+			return False
+		if self.bloom_size and not self._in_bloom(digest):
+			return False
+		low = 0
+		high = self.count
+		while low < high:
+			middle = (low + high) // 2
+			offset = self._records_offset + middle * self.digest_size
+			record = self._mm[offset:offset+self.digest_size]
+			if record < digest:
+				low = middle + 1
+			elif record > digest:
+				high = middle
+			else:
+				return True
+		return False
+
+	def __len__(self):
+		'''Number of digests in index'''
+		return self.count
+
+	def close(self):
+		'''Close memory map and file'''
+		self._mm.close()
+		self._fh.close()
+
+class HashFlags:
+	'''Flag files as alert or known by looking up their digests in HashIndex files'''
+
+	ALERT = 'alert'
+	KNOWN = 'known'
+
+	def __init__(self, known=None, alert=None):
+		'''Open indexes given as lists of paths'''
+		self.indexes = [(self.ALERT, HashIndex(path)) for path in alert or ()]
+		self.indexes += [(self.KNOWN, HashIndex(path)) for path in known or ()]
+		self.algorithms = sorted({index.algorithm for flag, index in self.indexes})
+
+	def flag(self, digests):
+		'''Get flag for digests given as dict {algorithm: hex digest}, alert has priority'''
+		for flag, index in self.indexes:
+			if digests.get(index.algorithm) in index:
+				return flag
+		return ''
+
+	def close(self):
+		'''Close all indexes'''
+		for flag, index in self.indexes:
+			index.close()
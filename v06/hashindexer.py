@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__app_name__ = 'HashIndexer'
+__author__ = 'Markus Thilo'
+__version__ = '0.6.0_2025-07-14'
+__license__ = 'GPL-3'
+__email__ = 'markus.thilo@gmail.com'
+__status__ = 'Testing'
+__description__ = '''
+Compile hash lists (one hash per line, CSV/TSV or NSRL style) into a sorted binary index file.
+HashedCopy, HashedRoboCopy and ZipImager use such files to flag known or alert files.
+'''
+
+from pathlib import Path
+from argparse import ArgumentParser
+from lib.pathutils import PathUtils
+from lib.timestamp import TimeStamp
+from lib.logger import Logger
+from lib.hashindex import HashIndex
+
+class HashIndexer:
+	'''Build index files from hash lists'''
+
+	def __init__(self, echo=print):
+		'''Create object'''
+		self.available = True
+		self.echo = echo
+
+	def compile(self, sources, algorithm='md5', bloom=None, filename=None, outdir=None, log=None):
+		'''Compile hash lists into one index file'''
+		self.filename = TimeStamp.now_or(filename, base='hashindex')
+		self.outdir = PathUtils.mkdir(outdir)
+		self.index_path = self.outdir / f'{self.filename}.idx'
+		self.log = log if log else Logger(
+			filename=self.filename, outdir=self.outdir, head='hashindexer.HashIndexer', echo=self.echo)
+		source_paths = [Path(source) for source in sources]
+		for source_path in source_paths:
+			if not source_path.is_file():
+				self.log.error(f'Unable to read {source_path}')
+		self.log.info(f'Compiling {algorithm} hashes from {len(source_paths)} list(s)', echo=True)
+		cnt = HashIndex.compile(source_paths, self.index_path, algorithm=algorithm, bloom_bits=bloom, echo=self.echo)
+		self.log.info(f'Wrote {cnt} unique hash(es) to {self.index_path}', echo=True)
+
+class HashIndexerCli(ArgumentParser):
+	'''CLI for the index compiler'''
+
+	def __init__(self, echo=print):
+		'''Define CLI using argparser'''
+		super().__init__(description=__description__.strip(), prog=__app_name__.lower())
+		self.add_argument('-a', '--algorithm', type=str, default='md5',
+			choices=list(HashIndex.DIGEST_SIZES.values()),
+			help='Hash algorithm of the lists (default: md5)', metavar='STRING'
+		)
+		self.add_argument('-b', '--bloom', type=int,
+			help=f'Bits per hash for the Bloom prefilter, 0 = none (default: {HashIndex.BLOOM_BITS})', metavar='INTEGER'
+		)
+		self.add_argument('-f', '--filename', type=str,
+			help='Filename to generated (without extension)', metavar='STRING'
+		)
+		self.add_argument('-o', '--outdir', type=Path,
+			help='Directory to write index and log (default: current)', metavar='DIRECTORY'
+		)
+		self.add_argument('sources', nargs='+', type=Path,
+			help='Hash lists to compile', metavar='FILE'
+		)
+		self.echo = echo
+
+	def parse(self, *cmd):
+		'''Parse arguments'''
+		args = super().parse_args(*cmd)
+		self.algorithm = args.algorithm
+		self.bloom = args.bloom
+		self.filename = args.filename
+		self.outdir = args.outdir
+		self.sources = args.sources
+
+	def run(self):
+		'''Run the tool'''
+		indexer = HashIndexer(echo=self.echo)
+		indexer.compile(self.sources,
+			algorithm = self.algorithm,
+			bloom = self.bloom,
+			filename = self.filename,
+			outdir = self.outdir
+		)
+		indexer.log.close()
+
+if __name__ == '__main__':	# start here if called as application
+	app = HashIndexerCli()
+	app.parse()
+	app.run()
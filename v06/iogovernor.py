@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from math import isfinite
+from threading import Lock
+from time import monotonic, sleep
+from .devutils import DevUtils
+
+class TokenBucket:
+	'''Limit bytes per second, the rate can be changed at any time'''
+
+	BURST_SECONDS = 0.25	# tokens that can be saved up while idle
+	MAX_SLEEP = 0.25	# react on changed rate while waiting
+
+	def __init__(self, rate):
+		'''Rate is given in bytes per second'''
+		self._lock = Lock()
+		self.rate = rate
+		self._tokens = 0
+		self._time = monotonic()
+
+	def _refill(self):
+		'''Add tokens for the time since last refill (has to be called with lock)'''
+		now = monotonic()
+		if self.rate:
+			self._tokens = min(self.rate * self.BURST_SECONDS, self._tokens + (now - self._time) * self.rate)
+		self._time = now
+
+	def consume(self, size):
+		'''Take size tokens, block while the bucket is in debt'''
+		with self._lock:
+			self._refill()
+			self._tokens -= size
+		while True:
+			with self._lock:
+				if not self.rate or self.rate < 0:	# unlimited, a negative rate would never refill
+					self._tokens = 0
+					return
+				self._refill()
+				if self._tokens >= 0:
+					return
+				wait = -self._tokens / self.rate
+			sleep(max(0, min(wait, self.MAX_SLEEP)))
+
+class IoGovernor:
+	'''Process wide I/O bandwidth limits per device, all readers and writers draw from the same buckets,
+		limits can be changed at runtime (e.g. from the GUI while jobs are running)
+	'''
+
+	METADATA_COST = 4096	# bytes counted for reading one directory
+	active = False	# nothing to do until a limit is set
+	_lock = Lock()
+	_default = None
+	_limits = dict()
+	_buckets = dict()
+
+	@staticmethod
+	def _rate(device):
+		'''Get limit in bytes per second for one device (has to be called with lock)'''
+		return IoGovernor._limits.get(device, IoGovernor._default)
+
+	@staticmethod
+	def set_limit(rate, path=None):
+		'''Set limit in bytes per second for the device of path or the default for all devices, None or 0 = unlimited,
+			raise ValueError on negative rate (the buckets would never refill)
+		'''
+		if rate and rate < 0:
+			raise ValueError(f'Negative limit {rate} B/s')
+		with IoGovernor._lock:
+			if path is None:
+				IoGovernor._default = rate if rate else None
+			else:
+				device = DevUtils.device_id(path)
+				if rate:
+					IoGovernor._limits[device] = rate
+				else:
+					IoGovernor._limits.pop(device, None)
+			for device, bucket in IoGovernor._buckets.items():
+				bucket.rate = IoGovernor._rate(device)
+			IoGovernor.active = IoGovernor._default is not None or bool(IoGovernor._limits)
+
+	@staticmethod
+	def set_mbps(mbps, path=None):
+		'''Set limit in MB/s (SI), e.g. from CLI or GUI'''
+		IoGovernor.set_limit(int(mbps * 1000000) if mbps else None, path=path)
+
+	@staticmethod
+	def parse_mbps(value):
+		'''Get limit in MB/s from string, empty or 0 give None (unlimited), raise ValueError if not a positive number'''
+		value = f'{value}'.strip()
+		mbps = float(value) if value else 0
+		if mbps < 0 or not isfinite(mbps):
+			raise ValueError(f'{value} is not a positive number (MB/s) or 0 (unlimited)')
+		return mbps if mbps else None
+
+	@staticmethod
+	def set_limits(specs):
+		'''Set limits given as "MB/S" (default for every device) or "PATH=MB/S" (device holding PATH),
+			return descriptions for the log, raise ValueError on invalid limit or inaccessible path
+		'''
+		descriptions = list()
+		for spec in specs:
+			path, separator, mbps = f'{spec}'.rpartition('=')
+			mbps = IoGovernor.parse_mbps(mbps)
+			if separator:
+				if DevUtils.device_id(path) is None:
+					raise ValueError(f'{path} is not accessible')
+				IoGovernor.set_mbps(mbps, path=path)
+				descriptions.append(f'{mbps} MB/s for the device of {path}' if mbps else f'no limit for the device of {path}')
+			else:
+				IoGovernor.set_mbps(mbps)
+				descriptions.append(f'{mbps} MB/s per device' if mbps else 'no limit per device')
+		return descriptions
+
+	@staticmethod
+	def reset():
+		'''Remove all limits, e.g. when a job starts'''
+		with IoGovernor._lock:
+			IoGovernor._default = None
+			IoGovernor._limits.clear()
+			for bucket in IoGovernor._buckets.values():
+				bucket.rate = None	# wake up waiting readers and writers
+			IoGovernor._buckets.clear()
+			IoGovernor.active = False
+
+	@staticmethod
+	def get_limit(path=None):
+		'''Get limit in bytes per second for the device of path or the default, None if unlimited'''
+		with IoGovernor._lock:
+			return IoGovernor._rate(DevUtils.device_id(path)) if path else IoGovernor._default
+
+	@staticmethod
+	def draw(device, size):
+		'''Take bandwidth for size bytes read from or written to device (st_dev), blocks if the limit is exceeded'''
+		if not IoGovernor.active:
+			return
+		with IoGovernor._lock:
+			rate = IoGovernor._rate(device)
+			if not rate:
+				return
+			if not device in IoGovernor._buckets:
+				IoGovernor._buckets[device] = TokenBucket(rate)
+			bucket = IoGovernor._buckets[device]
+		bucket.consume(size)
+
+	@staticmethod
+	def draw_path(path, size):
+		'''Take bandwidth for the device of path'''
+		if IoGovernor.active:
+			IoGovernor.draw(DevUtils.device_id(path), size)
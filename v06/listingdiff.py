@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__app_name__ = 'ListingDiff'
+__author__ = 'Markus Thilo'
+__version__ = '0.6.0_2025-07-21'
+__license__ = 'GPL-3'
+__email__ = 'markus.thilo@gmail.com'
+__status__ = 'Testing'
+__description__ = '''
+Compare two TSV listings (e.g. written by HashedCopy, ZipImager or AxChecker) of any size.
+Both are sorted by a key column in bounded memory (external merge sort) and compared in one streaming pass.
+'''
+
+from pathlib import Path
+from argparse import ArgumentParser
+from lib.pathutils import PathUtils
+from lib.timestamp import TimeStamp
+from lib.logger import Logger
+from lib.extsort import ExternalSort
+
+class ListingDiff:
+	'''Sort and compare listings'''
+
+	def __init__(self, echo=print):
+		'''Create object'''
+		self.available = True
+		self.echo = echo
+
+	def _head(self, listing_path):
+		'''Read head line of listing'''
+		try:
+			with listing_path.open(encoding='utf-8') as fh:
+				return fh.readline().rstrip('\n').split('\t')
+		except OSError:
+			self.log.error(f'Unable to read {listing_path}')
+
+	def _items(self, sorted_path, key_col, value_cols):
+		'''Generate (key, values) from sorted listing'''
+		with sorted_path.open(encoding='utf-8') as fh:
+			fh.readline()
+			for line in fh:
+				row = line.rstrip('\n').split('\t')
+				yield row[key_col] if key_col < len(row) else '', tuple(row[col] if col < len(row) else '' for col in value_cols)
+
+	def compare(self, listing_a, listing_b, column=None, ignore=None, filename=None, outdir=None, log=None):
+		'''Sort both listings by column (name, default: first column) and write the differences as TSV,
+			columns in ignore (list of names) are not compared, e.g. destination paths that differ between runs
+		'''
+		self.filename = TimeStamp.now_or(filename, base='listingdiff')
+		self.outdir = PathUtils.mkdir(outdir)
+		self.tsv_path = self.outdir / f'{self.filename}_diff.tsv'
+		self.log = log if log else Logger(
+			filename=self.filename, outdir=self.outdir, head='listingdiff.ListingDiff', echo=self.echo)
+		self.listing_a = Path(listing_a)
+		self.listing_b = Path(listing_b)
+		head_a = self._head(self.listing_a)
+		head_b = self._head(self.listing_b)
+		if not column:
+			column = head_a[0]
+		if not column in head_a or not column in head_b:
+			self.log.error(f'Both listings need the column {column}')
+		ignore = set(ignore) if ignore else set()
+		columns = [name for name in head_a if name in head_b and name != column and not name in ignore]
+		if not_compared := [name for name in head_a + head_b if not name in columns and name != column and not name in ignore]:
+			self.log.warning(f'Column(s) only in one listing are not compared: {", ".join(dict.fromkeys(not_compared))}')
+		sorted_paths = list()
+		for listing_path, head, suffix in ((self.listing_a, head_a, 'a'), (self.listing_b, head_b, 'b')):
+			sorted_path = self.outdir / f'{self.filename}_{suffix}_sorted.tsv'
+			self.echo(f'Sorting {listing_path} by {column}')
+			cnt = ExternalSort.sort_tsv(listing_path, sorted_path, column=head.index(column))
+			self.log.info(f'Sorted {cnt} row(s) of {listing_path} to {sorted_path}', echo=True)
+			sorted_paths.append(sorted_path)
+		items_a = self._items(sorted_paths[0], head_a.index(column), [head_a.index(name) for name in columns])
+		items_b = self._items(sorted_paths[1], head_b.index(column), [head_b.index(name) for name in columns])
+		diff_cnts = {'only_a': 0, 'only_b': 0, 'differ': 0}
+		with self.tsv_path.open('w', encoding='utf-8') as fh:
+			print(f'{column}\tDifference\tColumns', file=fh)
+			for key, difference, values_a, values_b in ExternalSort.diff(items_a, items_b):
+				if difference == 'differ':
+					differing = ','.join(name for name, value_a, value_b in zip(columns, values_a, values_b) if value_a != value_b)
+				else:
+					differing = ''
+				print(f'{key}\t{difference}\t{differing}', file=fh)
+				diff_cnts[difference] += 1
+		if sum(diff_cnts.values()) == 0:
+			self.log.info('Listings are identical', echo=True)
+			return
+		self.log.warning(
+			f'Listings differ: {diff_cnts["differ"]} row(s) differ, {diff_cnts["only_a"]} only in {self.listing_a.name}, {diff_cnts["only_b"]} only in {self.listing_b.name}, check {self.tsv_path}'
+		)
+
+class ListingDiffCli(ArgumentParser):
+	'''CLI for the listing comparison'''
+
+	def __init__(self, echo=print):
+		'''Define CLI using argparser'''
+		super().__init__(description=__description__.strip(), prog=__app_name__.lower())
+		self.add_argument('-c', '--column', type=str,
+			help='Name of the key column to sort and match rows by (default: first column)', metavar='STRING'
+		)
+		self.add_argument('-f', '--filename', type=str,
+			help='Filename to generated (without extension)', metavar='STRING'
+		)
+		self.add_argument('-i', '--ignore', type=str, action='append',
+			help='Name of a column not to compare, can be given multiple times', metavar='STRING'
+		)
+		self.add_argument('-o', '--outdir', type=Path,
+			help='Directory to write sorted listings, differences and log (default: current)', metavar='DIRECTORY'
+		)
+		self.add_argument('listings', nargs=2, type=Path,
+			help='Two TSV listings with head line', metavar='FILE'
+		)
+		self.echo = echo
+
+	def parse(self, *cmd):
+		'''Parse arguments'''
+		args = super().parse_args(*cmd)
+		self.listing_a, self.listing_b = args.listings
+		self.column = args.column
+		self.ignore = args.ignore
+		self.filename = args.filename
+		self.outdir = args.outdir
+
+	def run(self):
+		'''Run the tool'''
+		listing_diff = ListingDiff(echo=self.echo)
+		listing_diff.compare(self.listing_a, self.listing_b,
+			column = self.column,
+			ignore = self.ignore,
+			filename = self.filename,
+			outdir = self.outdir
+		)
+		listing_diff.log.close()
+
+if __name__ == '__main__':	# start here if called as application
+	app = ListingDiffCli()
+	app.parse()
+	app.run()
@@ -7,11 +7,11 @@ from .timestamp import TimeStamp
 class Logger:
 	'''Simple logging'''
 
-	def __init__(self, filename=None, outdir=None, head='Start task', echo=print):
-		'''Open/create directory to write logs'''
+	def __init__(self, filename=None, outdir=None, head='Start task', echo=print, append=False):
+		'''Open/create directory to write logs, append=True continues an existing log (e.g. to resume)'''
 		self.path = PathUtils.mkdir(outdir).joinpath(
 			f'{filename}_log.txt' if filename else f'{TimeStamp.now(path_comp=True)}_log.txt')
-		self._fh = self.path.open(mode='w', buffering=1)
+		self._fh = self.path.open(mode='a' if append else 'w', buffering=1)
 		self.info(head)
 		self.echo = echo
 
@@ -15,12 +15,15 @@ ewfimager.py
 fallbackimager.py
 fallbackimager.sh*
 hashedcopy.py
+hashindexer.py
 help.txt
 LICENSE
+listingdiff.py
 README.md
 reporter-example-template.txt
 reporter.py
 sqlite.py
+treecompare.py
 wipe-log-head.txt
 wiper.py
 zipimager.py
@@ -30,19 +33,26 @@ do
     cp -ufv "lib/${file}" dist-lin/lib
 done << EOF
 axcheckergui.py
+copyutils.py
+devutils.py
 diskselectgui.py
 ewfcheckergui.py
 ewfimagergui.py
+extsort.py
 guibase.py
 guiconfig.py
+hashcache.py
 guielements.py
 guilabeling.py
 hashedcopygui.py
 hashes.py
+hashindex.py
+iogovernor.py
 linsettingsgui.py
 linutils.py
 logger.py
 mfdbreader.py
+pathfilter.py
 pathutils.py
 reportergui.py
 settings.py
@@ -50,6 +60,7 @@ sqlitegui.py
 sqliteutils.py
 stringutils.py
 timestamp.py
+treedigest.py
 wipergui.py
 worker.py
 zipimagergui.py
@@ -7,6 +7,15 @@ from .pathutils import PathUtils
 class MfdbReader(SQLiteReader):
 	'''Extend SqliteReader for AXIOM data base'''
 
+	FETCH_ROWS = 10000	# rows fetched at once
+	SCANNED_WALKS = 8	# walks answered by scanning the table, building the path index costs about as much as 8 scans
+
+	def __init__(self, mfdb_path):
+		'''Open database'''
+		super().__init__(mfdb_path)
+		self._walks = 0
+		self._path_index = False
+
 	def _read_source(self):
 		'''Read table source'''
 		for source_id, parent_source_id, source_type, source_friendly_value in self.fetch_table('source',
@@ -18,61 +27,68 @@ class MfdbReader(SQLiteReader):
 				parent_source_id = None
 			yield source_id, parent_source_id, source_type, source_friendly_value
 
-	def _read_paths(self):
-		'''Read table source_path'''
-		for source_id, source_path in self.fetch_table('source_path',
-			columns=('source_id', 'source_path')):
-			yield int(source_id), source_path
+	def _query(self, cmd, *params):
+		'''Run query on its own cursor and generate rows, fetched in blocks to keep the memory usage low'''
+		cursor = self.db.cursor()
+		cursor.execute(cmd, params)
+		while rows := cursor.fetchmany(self.FETCH_ROWS):
+			yield from rows
+		cursor.close()
 
-	def get_types(self):
-		'''Read table source and get types'''
-		self.types = {int(source_id): source_type
-			for source_id, source_type
-			in self.fetch_table('source', columns=('source_id', 'source_type'))
-		}
+	def _joined_paths(self, where='', *params):
+		'''Generate (source_id, source_type, source_path) by joining source_path with source'''
+		for source_id, source_type, source_path in self._query(
+			f'''SELECT source_path.source_id, source.source_type, source_path.source_path
+			FROM source_path JOIN source ON source.source_id = source_path.source_id {where}''', *params):
+			yield int(source_id), source_type, source_path
 
 	def read_roots(self, max_depth=2):
 		'''Read potential root paths to compare'''
-		self.get_types()
-		for source_id, source_path in self._read_paths():
-			source_type = self.types[source_id]
-			if source_type != 'File' and source_path.count('\\') < max_depth:
+		for source_id, source_type, source_path in self._joined_paths('WHERE source.source_type != ?', 'File'):
+			if source_path.count('\\') < max_depth:
 				yield source_id, source_type, source_path
 
 	def read_paths(self):
-		'''Read table source_path and get source_type from table source'''
-		self.get_types()
-		self.paths = dict()
-		self.file_ids = set()	# ids of files to compare with hits
-		for source_id, source_path in self._read_paths():
-			source_type = self.types[source_id]
-			self.paths[source_id] = (source_type, source_path)
-			if self.types[source_id] == 'File':
-				self.file_ids.add(source_id)
-			yield source_id, source_type, source_path
+		'''Read table source_path with source_type from table source'''
+		return self._joined_paths()
 
-	def get_hit_ids(self):
-		'''Get hit ids'''
-		self.hit_ids = {source_id
-			for source_id
-			in self.fetch_table('hit_location', column='hit_location_id')}
-		return self.hit_ids
+	def read_no_hits(self):
+		'''Read files that are not represented in table hit_location (anti-join)'''
+		return self._joined_paths('''WHERE source.source_type = ? AND NOT EXISTS (
+			SELECT 1 FROM hit_location WHERE hit_location.hit_location_id = source_path.source_id)''', 'File')
 
-	def get_paths(self):
-		'''Get paths as dict'''
-		self.get_types()
-		self.paths = { source_id: (self.types[source_id], source_path)
-			for source_id, source_path in self._read_paths()
-		}
+	def get_path(self, source_id):
+		'''Get (source_type, source_path) of one source'''
+		for source_id, source_type, source_path in self._joined_paths('WHERE source_path.source_id = ?', source_id):
+			return source_type, source_path
+
+	def _build_path_index(self):
+		'''Copy joined paths once to a temporary table with an index on source_path, the case file is not changed'''
+		if self._path_index:
+			return
+		self.cursor.execute('''CREATE TEMP TABLE path_index AS
+			SELECT source_path.source_id AS source_id, source.source_type AS source_type, source_path.source_path AS source_path
+			FROM source_path JOIN source ON source.source_id = source_path.source_id''')
+		self.cursor.execute('CREATE INDEX temp.path_index_source_path ON path_index (source_path)')
+		self._path_index = True
 
 	def walk(self, root_id):
-		'''Recursivly get sub-paths'''
-		self.get_paths()
-		root_path = f'{self.paths[root_id][1]}\\'
+		'''Recursivly get sub-paths by a range query: root\\ <= path < root] (] follows \\),
+			the first walks scan the table once each, more walks on the same case use a temporary path index
+		'''
+		root_path = f'{self.get_path(root_id)[1]}\\'
 		root_len = len(root_path)
-		for source_id, (source_type, source_path) in self.paths.items():
-			if source_path.startswith(root_path):
-				yield source_id, source_type, source_path[root_len:]
+		self._walks += 1
+		if self._walks > self.SCANNED_WALKS:
+			self._build_path_index()
+			rows = self._query(
+				'SELECT source_id, source_type, source_path FROM temp.path_index WHERE source_path >= ? AND source_path < ?',
+				root_path, f'{root_path[:-1]}]')
+		else:	# a few walks (e.g. one AxChecker compare) do not pay off the index
+			rows = self._joined_paths('WHERE source_path.source_path >= ? AND source_path.source_path < ?',
+				root_path, f'{root_path[:-1]}]')
+		for source_id, source_type, source_path in rows:
+			yield int(source_id), source_type, source_path[root_len:]
 
 	def get_relative_paths(self, root_id):
 		'''Get relative paths under given root'''
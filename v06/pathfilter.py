@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from os import name as os_name
+from fnmatch import translate
+from re import compile as re_compile, error as re_error, IGNORECASE
+from pathlib import Path
+
+class PathFilter:
+	'''Include and exclude rules that prune the walk, given as glob or as regular expression with prefix "re:",
+		globs without slash match the name, globs with slash and regular expressions the relative path (posix style)
+	'''
+
+	REGEX = 're:'
+	FLAGS = IGNORECASE if os_name == 'nt' else 0
+	NOT_INCLUDED = 'not included'
+
+	def __init__(self, include=None, exclude=None):
+		'''Rules are given as lists of strings and compiled once, raise ValueError on invalid regular expression'''
+		self.include = [self._compile(rule) for rule in include] if include else list()
+		self.exclude = [self._compile(rule) for rule in exclude] if exclude else list()
+
+	def _compile(self, rule):
+		'''Compile rule to (rule, match path or name, compiled pattern)'''
+		try:
+			if rule.startswith(self.REGEX):
+				return rule, True, re_compile(rule[len(self.REGEX):], self.FLAGS).search
+			glob = rule.strip('/')
+			return rule, '/' in glob, re_compile(translate(glob), self.FLAGS).match
+		except re_error as ex:
+			raise ValueError(f'{rule}: {ex}')
+
+	@staticmethod
+	def _first(rules, relative, name):
+		'''Get first rule that matches or None'''
+		for rule, on_path, match in rules:
+			if match(relative if on_path else name):
+				return rule
+
+	def prune(self, relative, tp):
+		'''Get the rule that prunes item (relative path as Path) or None to keep it,
+			exclude rules prune directories with all their content, include rules only apply to files and others
+		'''
+		relative = relative.as_posix()
+		name = relative.rsplit('/', 1)[-1]
+		if rule := self._first(self.exclude, relative, name):
+			return rule
+		if self.include and tp != 'dir' and not self._first(self.include, relative, name):
+			return self.NOT_INCLUDED
+
+class PrunedList:
+	'''Write pruned items to TSV and count them by type'''
+
+	def __init__(self, path):
+		'''Open TSV'''
+		self.path = Path(path)
+		self._fh = self.path.open('w', encoding='utf-8')
+		print('Path\tType\tRule', file=self._fh)
+		self.cnts = {'dir': 0, 'file': 0, 'other': 0}
+
+	def add(self, path, relative, tp, rule):
+		'''Record one pruned item, content of pruned directories is never read'''
+		print(f'{path}\t{tp}\t{rule}', file=self._fh)
+		self.cnts[tp if tp in self.cnts else 'other'] += 1
+
+	def close(self):
+		'''Close TSV and return message for the log'''
+		self._fh.close()
+		return f'Pruned {self.cnts["dir"]} dir(s), {self.cnts["file"]} file(s) and {self.cnts["other"]} other item(s), check {self.path}'
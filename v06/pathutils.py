@@ -1,17 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from os import scandir
+from threading import Thread, Lock
+from time import monotonic
 from pathlib import Path, WindowsPath, PosixPath
 from multiprocessing import Process
 from shutil import copytree
 from unicodedata import normalize
 from string import ascii_letters, digits
+from concurrent.futures import ThreadPoolExecutor
+from .devutils import DevUtils
+from .iogovernor import IoGovernor
+from .stringutils import StringUtils
 
 __utf__ = 'utf-16-le', 'utf-16-be', 'utf-16', 'utf-8'
 
 class PathUtils:
 	'''Additional abilities for pathlib'''
 
+	PREFETCH_PER_WORKER = 64	# listings held ahead of the walk, this bounds the memory usage
+
 	@staticmethod
 	def mkdir(path):
 		'''Create directory or just give full dorectory path if exists'''
@@ -53,33 +62,128 @@ class PathUtils:
 		return f'{path}'.strip('\t\n\\').replace('\n', ' ').replace('\t', ' ').replace('\r', '')
 
 	@staticmethod
-	def walk(root):
-		'''Walk but give path, relative path and type'''
-		for path in root.rglob('*'):
-			if path.is_file():
-				tp = 'file'
-			elif path.is_dir():
-				tp = 'dir'
-			else:
-				tp = None
-			yield path, path.relative_to(root), tp
+	def _scandir(path):
+		'''Get directory entries sorted by name, empty list if directory is not readable'''
+		IoGovernor.draw_path(path, IoGovernor.METADATA_COST)
+		try:
+			with scandir(path) as entries:
+				return sorted(entries, key=lambda entry: entry.name)
+		except OSError:
+			return list()
+
+	@staticmethod
+	def _entry_type(entry):
+		'''Get type from directory entry, d_type is used unless entry is a symlink'''
+		try:
+			if entry.is_file():
+				return 'file'
+			if entry.is_dir():
+				return 'dir'
+		except OSError:
+			pass
+
+	@staticmethod
+	def _entry_stat(entry):
+		'''Get stat result cached by directory entry or None'''
+		try:
+			return entry.stat()
+		except OSError:
+			return None
+
+	@staticmethod
+	def _list(path, relative, with_stat, prune):
+		'''List directory as sorted (path, name, type, stat, descend, rule),
+			descend is False for symlinked or pruned directories, rule is the filter rule that prunes the item
+		'''
+		items = list()
+		for entry in PathUtils._scandir(path):
+			tp = PathUtils._entry_type(entry)
+			rule = prune.prune(relative / entry.name, tp) if prune else None
+			items.append((Path(entry.path), entry.name, tp,
+				PathUtils._entry_stat(entry) if with_stat and not rule else None,
+				tp == 'dir' and not rule and not entry.is_symlink(),
+				rule
+			))
+		return items
+
+	@staticmethod
+	def _walk(root, with_stat, workers=None, prune=None, pruned=None):
+		'''Walk depth first in sorted order using scandir, stat is only given if with_stat is True,
+			with workers > 1 subdirectories are listed ahead in parallel (order of the output stays the same),
+			items matching the PathFilter prune are skipped and given to pruned(path, relative, type, rule)
+		'''
+		root = Path(root)
+		if workers is None:
+			workers = DevUtils.walk_workers(root)
+		executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+		prefetched = dict()	# directory path: future of its listing
+		lock = Lock()
+		def prefetch(relative_parent, items):
+			with lock:
+				for path, name, tp, stat, descend, rule in items:
+					if len(prefetched) >= workers * PathUtils.PREFETCH_PER_WORKER:
+						return
+					if descend and not path in prefetched:
+						try:
+							prefetched[path] = executor.submit(fetch, path, relative_parent / name)
+						except RuntimeError:	# walk has been closed
+							return
+		def fetch(path, relative):	# runs in worker thread and goes on with the subdirectories
+			items = PathUtils._list(path, relative, with_stat, prune)
+			prefetch(relative, items)
+			return items
+		def listing(path, relative):
+			with lock:
+				future = prefetched.pop(path, None)
+			items = future.result() if future else PathUtils._list(path, relative, with_stat, prune)
+			if executor:
+				prefetch(relative, items)	# subdirectories skipped by a full prefetch
+			return iter(items)
+		try:
+			stack = [(Path(), listing(root, Path()))]
+			while stack:
+				relative_parent, items = stack[-1]
+				for path, name, tp, stat, descend, rule in items:
+					relative = relative_parent / name
+					if rule:
+						if pruned:
+							pruned(path, relative, tp, rule)
+						continue
+					yield path, relative, tp, stat
+					if descend:
+						stack.append((relative, listing(path, relative)))
+						break
+				else:
+					stack.pop()
+		finally:
+			if executor:
+				executor.shutdown(wait=False, cancel_futures=True)
+
+	@staticmethod
+	def walk_stat(root, workers=None, prune=None, pruned=None):
+		'''Walk depth first in sorted order, give path, relative path, type and stat result
+			(scandir caches it, e.g. st_size and st_mtime_ns, None if not accessible),
+			workers = directories listed in parallel, None to decide by file system (remote/FUSE or local),
+			prune = PathFilter, pruned items are given to the callback pruned(path, relative, type, rule)
+		'''
+		return PathUtils._walk(root, True, workers=workers, prune=prune, pruned=pruned)
+
+	@staticmethod
+	def walk(root, workers=None, prune=None, pruned=None):
+		'''Walk depth first in sorted order but give path, relative path and type'''
+		for path, relative, tp, stat in PathUtils._walk(root, False, workers=workers, prune=prune, pruned=pruned):
+			yield path, relative, tp
 
 	@staticmethod
 	def parented_walk(root):
 		'''Walk but give path, parent, name and type'''
-		for path in root.rglob('*'):
-			if path.is_dir():
-				tp = 'dir'
-			elif path.is_file():
-				tp = 'file'
-			else:
-				tp = None
+		for path, relative, tp in PathUtils.walk(root):
 			yield path, path.parent, path.name, tp
 
 	@staticmethod
 	def quantitiy(root):
 		'''Get quantitiy of all items'''
-		return len(list(root.rglob('*')))
+		return sum(1 for item in PathUtils.walk(root))
 
 	@staticmethod
 	def read_utf_head(path, lines_in=10, lines_out=1):
@@ -119,24 +223,76 @@ class PathUtils:
 		return string
 
 class Progressor:
-	'''Show progress when going through file structure'''
+	'''Show progress when going through file structure, weighted by bytes if sizes are known'''
 
-	def __init__(self, root_or_quant, echo=print, item='file/dir'):
-		'''Get quantitiy of files under root or give quantitiy as int'''
+	INTERVAL = 1	# seconds between messages
+	SMOOTHING = 0.3	# weight of the last interval in the throughput
+
+	def __init__(self, root_or_quant, echo=print, item='file/dir', total_bytes=None, prune=None):
+		'''Give quantitiy as int (and total_bytes if known, e.g. from an earlier walk)
+			or root to count items and bytes in a background thread while the work is running (pruned by PathFilter)
+		'''
 		self.echo = echo
 		self.item = item
+		self.counter = 0
+		self.bytes = 0
+		self.throughput = None
+		self._last_time = self._start_time = monotonic()
+		self._last_bytes = 0
 		if isinstance(root_or_quant, int):
 			self.quantitiy = root_or_quant
+			self.total_bytes = total_bytes
 		else:
-			self.quantitiy = PathUtils.quantitiy(root_or_quant)
-		self.counter = 0
-		self.percent = 0
-		self.factor = 100/self.quantitiy
+			self.quantitiy = None	# still counting
+			self.total_bytes = None
+			Thread(target=self._count, args=(root_or_quant, prune), daemon=True).start()
 
-	def inc(self):
-		'''Check and display message'''
+	def _count(self, root, prune):
+		'''Count items and bytes in background'''
+		quantitiy = 0
+		total_bytes = 0
+		for path, relative, tp, stat in PathUtils.walk_stat(root, prune=prune):
+			quantitiy += 1
+			if tp == 'file' and stat:
+				total_bytes += stat.st_size
+		self.total_bytes = total_bytes
+		self.quantitiy = quantitiy
+
+	@staticmethod
+	def _duration(seconds):
+		'''Format seconds as H:MM:SS'''
+		seconds = int(seconds)
+		return f'{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}'
+
+	def inc(self, size=0):
+		'''Count one item with size bytes and display message from time to time'''
 		self.counter += 1
-		percent = int(self.factor*self.counter)
-		if percent > self.percent:
-			self.percent = percent
-			self.echo(f'{self.percent}%, processing {self.item} {self.counter} of {self.quantitiy}', end='\r')
+		self.bytes += size
+		now = monotonic()
+		if now - self._last_time < self.INTERVAL:
+			return
+		rate = (self.bytes - self._last_bytes) / (now - self._last_time)
+		if self.throughput is None:
+			self.throughput = rate
+		else:
+			self.throughput = self.SMOOTHING * rate + (1 - self.SMOOTHING) * self.throughput
+		self._last_time = now
+		self._last_bytes = self.bytes
+		msg = f'processing {self.item} {self.counter}'
+		if self.quantitiy:
+			msg += f' of {self.quantitiy}'
+		if self.bytes:
+			msg += f', {StringUtils.bytes(self.throughput, format_k="{si}")}/s'
+		if self.quantitiy:
+			if self.total_bytes:
+				done = min(self.bytes / self.total_bytes, 1)
+				if self.throughput:
+					msg += f', ETA {self._duration(max(self.total_bytes - self.bytes, 0) / self.throughput)}'
+			else:
+				done = min(self.counter / self.quantitiy, 1)
+				if done:
+					msg += f', ETA {self._duration((now - self._start_time) * (1 - done) / done)}'
+			msg = f'{int(100 * done)}%, {msg}'
+		else:
+			msg += ' (counting)'
+		self.echo(msg, end='\r')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__app_name__ = 'TreeCompare'
+__author__ = 'Markus Thilo'
+__version__ = '0.6.0_2025-07-21'
+__license__ = 'GPL-3'
+__email__ = 'markus.thilo@gmail.com'
+__status__ = 'Testing'
+__description__ = '''
+Compare two tree digest manifests (*_tree.tsv written by HashedCopy or ZipImager).
+Only subtrees with differing digests are examined, identical trees are recognized by the root.
+'''
+
+from pathlib import Path
+from argparse import ArgumentParser
+from lib.pathutils import PathUtils
+from lib.timestamp import TimeStamp
+from lib.logger import Logger
+from lib.treedigest import TreeDigest
+
+class TreeCompare:
+	'''Compare trees by their Merkle digests'''
+
+	def __init__(self, echo=print):
+		'''Create object'''
+		self.available = True
+		self.echo = echo
+
+	def compare(self, manifest_a, manifest_b, filename=None, outdir=None, log=None):
+		'''Compare two manifests and write the differences as TSV'''
+		self.filename = TimeStamp.now_or(filename, base='treecompare')
+		self.outdir = PathUtils.mkdir(outdir)
+		self.tsv_path = self.outdir / f'{self.filename}_compare.tsv'
+		self.log = log if log else Logger(
+			filename=self.filename, outdir=self.outdir, head='treecompare.TreeCompare', echo=self.echo)
+		self.manifest_a = Path(manifest_a)
+		self.manifest_b = Path(manifest_b)
+		for manifest_path in (self.manifest_a, self.manifest_b):
+			if not manifest_path.is_file():
+				self.log.error(f'Unable to read {manifest_path}')
+		for manifest_path in (self.manifest_a, self.manifest_b):
+			algorithm, size, digest = TreeDigest.read_root(manifest_path)
+			self.log.info(f'Root of {manifest_path}: {digest} ({algorithm}, {size} bytes)', echo=True)
+		diff_cnts = {'only_a': 0, 'only_b': 0, 'differ': 0}
+		try:
+			with self.tsv_path.open('w', encoding='utf-8') as fh:
+				print('Path\tDifference', file=fh)
+				for relative, difference in TreeDigest.compare(self.manifest_a, self.manifest_b):
+					print(f'{relative}\t{difference}', file=fh)
+					diff_cnts[difference] += 1
+		except ValueError as ex:
+			self.log.error(f'Unable to compare: {ex}')
+		if sum(diff_cnts.values()) == 0:
+			self.log.info('Trees are identical', echo=True)
+			return
+		self.log.warning(
+			f'Trees differ: {diff_cnts["differ"]} item(s) differ, {diff_cnts["only_a"]} only in {self.manifest_a.name}, {diff_cnts["only_b"]} only in {self.manifest_b.name}, check {self.tsv_path}'
+		)
+
+class TreeCompareCli(ArgumentParser):
+	'''CLI for the tree comparison'''
+
+	def __init__(self, echo=print):
+		'''Define CLI using argparser'''
+		super().__init__(description=__description__.strip(), prog=__app_name__.lower())
+		self.add_argument('-f', '--filename', type=str,
+			help='Filename to generated (without extension)', metavar='STRING'
+		)
+		self.add_argument('-o', '--outdir', type=Path,
+			help='Directory to write differences and log (default: current)', metavar='DIRECTORY'
+		)
+		self.add_argument('manifests', nargs=2, type=Path,
+			help='Two tree digest manifests', metavar='FILE'
+		)
+		self.echo = echo
+
+	def parse(self, *cmd):
+		'''Parse arguments'''
+		args = super().parse_args(*cmd)
+		self.manifest_a, self.manifest_b = args.manifests
+		self.filename = args.filename
+		self.outdir = args.outdir
+
+	def run(self):
+		'''Run the tool'''
+		tree_compare = TreeCompare(echo=self.echo)
+		tree_compare.compare(self.manifest_a, self.manifest_b,
+			filename = self.filename,
+			outdir = self.outdir
+		)
+		tree_compare.log.close()
+
+if __name__ == '__main__':	# start here if called as application
+	app = TreeCompareCli()
+	app.parse()
+	app.run()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from hashlib import new as new_hash
+from pathlib import Path, PurePosixPath
+from .extsort import ExternalSort
+
+class TreeDigest:
+	'''Directory level Merkle tree: the digest of a directory covers names, types, sizes and digests of its children,
+		the manifest lists every directory before its content together with the byte length of the content,
+		so equal subtrees can be skipped when manifests are compared
+	'''
+
+	ALGORITHM = 'sha256'
+	ROOT = '.'
+
+	def __init__(self, path, algorithm=ALGORITHM):
+		'''Write manifest (TSV) to path, items have to be added in depth first order (as PathUtils.walk gives them)'''
+		self.path = Path(path)
+		self.algorithm = algorithm
+		self._body_path = self.path.with_name(f'{self.path.name}.part')
+		self._body_fh = self._body_path.open('w', encoding='utf-8', newline='\n')
+		self._written = 0	# bytes of the body, lines are only reordered when the manifest is written
+		self._stack = [((), list(), 0)]	# open directories as (parts, children, bytes written before their content)
+
+	def _print(self, line):
+		'''Write line to body and count its bytes'''
+		self._body_fh.write(f'{line}\n')
+		self._written += len(line.encode('utf-8')) + 1
+
+	def _close_dir(self):
+		'''Calculate digest of the directory on top of the stack and hand it to its parent'''
+		parts, children, start = self._stack.pop()
+		hash = new_hash(self.algorithm)
+		size = 0
+		for name, tp, child_size, digest in sorted(children):
+			hash.update(f'{name}\t{tp}\t{child_size}\t{digest}\n'.encode('utf-8'))
+			size += child_size
+		digest = hash.hexdigest()
+		content = self._written - start
+		if parts:
+			self._print(f'{PurePosixPath(*parts)}\tdir\t{size}\t{digest}\t{content}')
+			self._stack[-1][1].append((parts[-1], 'dir', size, digest))
+		return size, digest, content
+
+	def add(self, relative, tp, size=0, digest=''):
+		'''Add item by path relative to the root, tp is "file", "dir" or "other", digest is given as hex string'''
+		parts = PurePosixPath(Path(relative).as_posix()).parts
+		parent = parts[:-1]
+		while self._stack[-1][0] != parent[:len(self._stack[-1][0])] or len(self._stack[-1][0]) > len(parent):
+			self._close_dir()	# left this directory
+		while len(self._stack[-1][0]) < len(parent):	# parent has not been added
+			self._stack.append((parent[:len(self._stack[-1][0]) + 1], list(), self._written))
+		if tp == 'dir':
+			self._stack.append((parts, list(), self._written))
+		else:
+			self._print(f'{PurePosixPath(*parts)}\t{tp}\t{size}\t{digest}\t0')
+			self._stack[-1][1].append((parts[-1], tp, size, digest))
+
+	@staticmethod
+	def _parts(line):
+		'''Get path parts of manifest line, sorting by them puts every directory in front of its content'''
+		return line.split('\t', 1)[0].split('/')
+
+	def close(self):
+		'''Finish tree and write manifest with the root in the first line, return root digest'''
+		while len(self._stack) > 1:
+			self._close_dir()
+		self.size, self.root, content = self._close_dir()
+		self._body_fh.close()
+		ext_sort = ExternalSort(key=self._parts)	# the body has every directory after its content
+		with self._body_path.open(encoding='utf-8', newline='\n') as body_fh:
+			for line in body_fh:
+				ext_sort.add(line[:-1])
+		with self.path.open('w', encoding='utf-8', newline='\n') as fh:
+			print(f'Path\tType\tSize\t{self.algorithm}\tContent_Bytes', file=fh)
+			print(f'{self.ROOT}\tdir\t{self.size}\t{self.root}\t{content}', file=fh)
+			for line in ext_sort.sorted():
+				print(line, file=fh)
+		self._body_path.unlink()
+		return self.root
+
+	@staticmethod
+	def read_root(path):
+		'''Get algorithm, size and digest of the root from manifest'''
+		with Path(path).open(encoding='utf-8') as fh:
+			algorithm = fh.readline().rstrip('\n').split('\t')[3]
+			relative, tp, size, digest, content = fh.readline().rstrip('\n').split('\t')
+		return algorithm, int(size), digest
+
+	@staticmethod
+	def _read(fh):
+		'''Read next line of manifest opened in binary mode as (parts, type, size, digest, content bytes) or None'''
+		line = fh.readline()
+		if not line:
+			return
+		relative, tp, size, digest, content = line.decode('utf-8').rstrip('\n').split('\t')
+		return relative.split('/'), tp, int(size), digest, int(content)
+
+	@staticmethod
+	def compare(path_a, path_b):
+		'''Compare two manifests in one merge pass, the content of directories with equal digests is skipped (seek),
+			generate (relative path, difference) with difference "only_a", "only_b" or "differ"
+		'''
+		root_a = TreeDigest.read_root(path_a)
+		root_b = TreeDigest.read_root(path_b)
+		if root_a[0] != root_b[0]:
+			raise ValueError('Manifests are built with different hash algorithms')
+		if root_a == root_b:
+			return
+		with Path(path_a).open('rb') as fh_a, Path(path_b).open('rb') as fh_b:
+			for fh in (fh_a, fh_b):	# skip head and root
+				fh.readline()
+				fh.readline()
+			item_a = TreeDigest._read(fh_a)
+			item_b = TreeDigest._read(fh_b)
+			while item_a or item_b:
+				if not item_b or item_a and item_a[0] < item_b[0]:
+					yield '/'.join(item_a[0]), 'only_a'
+					fh_a.seek(item_a[4], 1)	# content of a reported directory is not examined
+					item_a = TreeDigest._read(fh_a)
+				elif not item_a or item_b[0] < item_a[0]:
+					yield '/'.join(item_b[0]), 'only_b'
+					fh_b.seek(item_b[4], 1)
+					item_b = TreeDigest._read(fh_b)
+				else:
+					if item_a[1] == item_b[1] == 'dir' and item_a[3] != item_b[3]:
+						pass	# differences are found in the content
+					else:
+						if item_a[1:4] != item_b[1:4]:
+							yield '/'.join(item_a[0]), 'differ'
+						fh_a.seek(item_a[4], 1)	# equal subtrees are skipped
+						fh_b.seek(item_b[4], 1)
+					item_a = TreeDigest._read(fh_a)
+					item_b = TreeDigest._read(fh_b)
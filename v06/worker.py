@@ -8,6 +8,7 @@ from threading import Thread
 
 from shlex import split as ssplit
 from .guilabeling import BasicLabels
+from .iogovernor import IoGovernor
 
 class Worker(Thread):
 	'''Work job after job'''
@@ -31,6 +32,11 @@ class Worker(Thread):
 			if not cmd_line:
 				break
 			echo(f'{BasicLabels.RUNNING}: {cmd_line}')
+			IoGovernor.reset()	# limits of the last job end with it, the limit from the GUI stays
+			try:
+				IoGovernor.set_mbps(self.gui.io_limit_mbps)
+			except AttributeError:
+				pass
 			args = ssplit(cmd_line)
 			if len(args) == 0 or not args[0]:
 				continue
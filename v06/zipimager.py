@@ -9,80 +9,206 @@ __email__ = 'markus.thilo@gmail.com'
 __status__ = 'Testing'
 __description__ = '''
 Using the Python library zipfile this module generates an ZIP archive from a source file structure.
+Paths in the tree digest manifest start with the name of the root (as HashedCopy writes them for a copied directory),
+so the manifest can be compared to the one of a copy of the same source.
 '''
 
+from os import fstat
 from pathlib import Path
-from zipfile import ZipFile, ZIP_DEFLATED
+from time import localtime
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP64_LIMIT
 from argparse import ArgumentParser
 from lib.pathutils import PathUtils, Progressor
 from lib.timestamp import TimeStamp
 from lib.logger import Logger
-from lib.hashes import FileHash
+from lib.stringutils import StringUtils
+from lib.hashes import FileHash, MultiHash, PieceHash
+from lib.hashindex import HashFlags
+from lib.devutils import DevUtils
+from lib.treedigest import TreeDigest
+from lib.iogovernor import IoGovernor
+from lib.pathfilter import PathFilter, PrunedList
 
 class ZipImager:
 	'''Imager using ZipFile'''
 
+	PHYSICAL_WINDOW = 4096	# files sorted by their position on disk
+
 	def __init__(self, echo=print):
 		'''Create object'''
 		self.available = True
 		self.echo = echo
 
-	def create(self, root, filename=None, outdir=None, hashes=['md5'], log=None):
-		'''Build zip file'''
+	def _zip_info(self, path, relative, stat):
+		'''Get ZipInfo from the stat result of the walk, ZipInfo.from_file would stat again'''
+		if not stat:
+			return ZipInfo.from_file(path, relative)
+		zinfo = ZipInfo(f'{relative.as_posix()}', localtime(stat.st_mtime)[:6])
+		zinfo.external_attr = (stat.st_mode & 0xFFFF) << 16
+		zinfo.file_size = stat.st_size
+		return zinfo
+
+	def _write_hashed(self, zf, path, relative, stat=None):
+		'''Write file into zip and calculate hashes while reading it'''
+		zinfo = self._zip_info(path, relative, stat)
+		zinfo.compress_type = ZIP_DEFLATED
+		multi = MultiHash(self.algorithms)
+		with (
+			path.open('rb', buffering=0) as src_fh,
+			zf.open(zinfo, 'w', force_zip64=zinfo.file_size * 1.05 > ZIP64_LIMIT) as dst_fh
+		):
+			device = fstat(src_fh.fileno()).st_dev
+			position = self.zip_fh.tell()
+			while size := src_fh.readinto(self.buffer):
+				IoGovernor.draw(device, size)
+				block = self.view[:size]
+				multi.update(block)
+				dst_fh.write(block)
+				written = self.zip_fh.tell()	# compressed bytes that went to the zip file
+				IoGovernor.draw(self.zip_device, written - position)
+				position = written
+		return zinfo.file_size, dict(zip(self.algorithms, multi.hexdigests()))
+
+	def _add(self, zf, path, relative, tp, stat=None):
+		'''Add one item to zip and return TSV line and entry for the tree digest'''
+		entry = relative, tp if tp else 'other', 0, ''
+		if tp == 'file':
+			try:
+				size, digests = self._write_hashed(zf, path, relative, stat)
+				entry = relative, tp, size, digests[TreeDigest.ALGORITHM]
+				if self.flags:
+					flag = self.flags.flag(digests)
+					if flag:
+						self.flag_cnts[flag] += 1
+						if flag == HashFlags.ALERT:
+							self.log.warning(f'Hash of {path} is in alert list')
+					line = f'"{relative}"\tFile\tyes\t{flag}'
+				else:
+					line = f'"{relative}"\tFile\tyes'
+				self.file_cnt += 1
+			except:
+				line = f'"{relative}"\tFile\tno{self.no_flag}'
+				self.file_error_cnt += 1
+		elif tp == 'dir':
+			try:
+				zf.mkdir(f'{relative}')
+				line = f'"{relative}"\tDir\tyes{self.no_flag}'
+				self.dir_cnt += 1
+			except:
+				line = f'"{relative}"\tDir\tno{self.no_flag}'
+				self.dir_error_cnt += 1
+		else:
+			line = f'"{relative}"\tOther\tno{self.no_flag}'
+			self.other_cnt += 1
+		self.progress.inc(entry[2])
+		return line, entry
+
+	def _write_line(self, tsv_fh, line, entry):
+		'''Write line to TSV and add entry to the tree digest, the tree starts with the name of the root'''
+		print(line, file=tsv_fh)
+		relative, tp, size, digest = entry
+		self.tree.add(self.tree_root / relative, tp, size, digest)
+
+	def _add_window(self, zf, window, tsv_fh):
+		'''Add files in the order of their position on disk, write TSV in path order'''
+		lines = dict()
+		for index, path, relative, tp, stat in sorted(window,
+			key = lambda item: DevUtils.physical_order(item[1]) if item[3] == 'file' else (-2, item[0], 0)
+		):
+			lines[index] = self._add(zf, path, relative, tp, stat)
+		for index, path, relative, tp, stat in window:
+			self._write_line(tsv_fh, *lines[index])
+		window.clear()
+
+	def create(self, root, filename=None, outdir=None, hashes=['md5'], pieces=False,
+			known=None, alert=None, physical=False, limit=None, include=None, exclude=None, log=None):
+		'''Build zip file, physical=True reads files in the order of their position on disk,
+			limit sets the I/O bandwidth in MB/s, as number or list of "MB/S" and "PATH=MB/S" (device of PATH),
+			include/exclude are lists of glob or regex rules (PathFilter) that prune the walk
+		'''
 		self.root_path = Path(root)
 		self.filename = TimeStamp.now_or(filename)
 		self.outdir = PathUtils.mkdir(outdir)
 		self.log = log if log else Logger(
 			filename=self.filename, outdir=self.outdir, head='zipimager.ZipImager', echo=self.echo)
+		if limit:
+			try:
+				limits = IoGovernor.set_limits(limit if isinstance(limit, (list, tuple)) else [limit])
+			except ValueError as ex:
+				self.log.error(f'Invalid I/O limit: {ex}')
+			self.log.info(f'Limiting I/O to {", ".join(limits)}', echo=True)
+		if include or exclude:
+			try:
+				prune = PathFilter(include=include, exclude=exclude)
+			except ValueError as ex:
+				self.log.error(f'Invalid filter rule {ex}')
+			pruned = PrunedList(self.outdir / f'{self.filename}_pruned.tsv')
+		else:
+			prune = pruned = None
 		self.echo('Creating Zip file')
 		self.image_path = self.outdir / f'{self.filename}.zip'
 		self.tsv_path = self.outdir / f'{self.filename}.tsv'
-		file_cnt = 0
-		dir_cnt = 0
-		other_cnt = 0
-		file_error_cnt = 0
-		dir_error_cnt = 0
-		progress = Progressor(self.root_path, echo=self.echo)
+		self.file_cnt = 0
+		self.dir_cnt = 0
+		self.other_cnt = 0
+		self.file_error_cnt = 0
+		self.dir_error_cnt = 0
+		self.flags = HashFlags(known=known, alert=alert) if known or alert else None
+		self.algorithms = [TreeDigest.ALGORITHM]	# files are hashed for the tree digest
+		self.buffer = FileHash.new_buffer()
+		self.view = memoryview(self.buffer)
+		self.tree_path = self.outdir / f'{self.filename}_tree.tsv'
+		self.tree = TreeDigest(self.tree_path)
+		self.tree_root = Path(self.root_path.name)	# same paths as in the manifest of HashedCopy
+		if self.root_path.name:
+			self.tree.add(self.tree_root, 'dir')
+		if self.flags:
+			self.algorithms += [alg for alg in self.flags.algorithms if alg != TreeDigest.ALGORITHM]
+			self.no_flag = '\t-'
+			self.flag_cnts = {HashFlags.ALERT: 0, HashFlags.KNOWN: 0}
+		else:
+			self.no_flag = ''
+		self.progress = Progressor(self.root_path, echo=self.echo, prune=prune)
 		with (
-			ZipFile(self.image_path, 'w', ZIP_DEFLATED) as zf,
+			self.image_path.open('wb') as self.zip_fh,
+			ZipFile(self.zip_fh, 'w', ZIP_DEFLATED) as zf,
 			self.tsv_path.open('w', encoding='utf-8') as tsv_fh
 		):
-			print('Path\tType\tCopied', file=tsv_fh)
-			for path, relative, tp in PathUtils.walk(self.root_path):
-				if tp == 'file':
-					try:
-						zf.write(path, relative)
-						print(f'"{relative}"\tFile\tyes', file=tsv_fh)
-						file_cnt += 1
-					except:
-						print(f'"{relative}"\tFile\tno', file=tsv_fh)
-						file_error_cnt += 1
-				elif tp == 'dir':
-					try:
-						zf.mkdir(f'{relative}')
-						print(f'"{relative}"\tDir\tyes', file=tsv_fh)
-						dir_cnt += 1
-					except:
-						print(f'"{relative}"\tDir\tno', file=tsv_fh)
-						dir_error_cnt += 1
-				else:
-					print(f'"{relative}"\tOther\tno', file=tsv_fh)
-					other_cnt += 1
-				progress.inc()
+			self.zip_device = fstat(self.zip_fh.fileno()).st_dev	# writes are limited as reads
+			print('Path\tType\tCopied\tFlag' if self.flags else 'Path\tType\tCopied', file=tsv_fh)
+			if physical:	# read files of a window in the order of their position on disk
+				window = list()
+				for index, (path, relative, tp, stat) in enumerate(PathUtils.walk_stat(self.root_path,
+					prune=prune, pruned=pruned.add if pruned else None)):
+					window.append((index, path, relative, tp, stat))
+					if len(window) >= self.PHYSICAL_WINDOW:
+						self._add_window(zf, window, tsv_fh)
+				self._add_window(zf, window, tsv_fh)
+			else:
+				for path, relative, tp, stat in PathUtils.walk_stat(self.root_path,
+					prune=prune, pruned=pruned.add if pruned else None):
+					self._write_line(tsv_fh, *self._add(zf, path, relative, tp, stat))
+		self.tree.close()
+		if pruned:
+			self.log.info(pruned.close(), echo=True)
 		msg = f'Created {self.image_path.name} '
-		msg += f'(Files: {file_cnt} / Directories: {dir_cnt})'
+		msg += f'(Files: {self.file_cnt} / Directories: {self.dir_cnt})'
 		self.log.info(msg, echo=True)
+		self.log.info(f'Tree digest ({self.tree.algorithm}) of the zipped files: {self.tree.root}, check {self.tree_path}', echo=True)
+		if self.flags:
+			self.flags.close()
+			self.log.info(f'Flagged {self.flag_cnts[HashFlags.ALERT]} alert and {self.flag_cnts[HashFlags.KNOWN]} known file(s)', echo=True)
 		msg = ''
-		if file_error_cnt > 0:
-			msg += f'{file_error_cnt} missing file(s)'
-		if dir_error_cnt > 0:
+		if self.file_error_cnt > 0:
+			msg += f'{self.file_error_cnt} missing file(s)'
+		if self.dir_error_cnt > 0:
 			if msg:
 				msg += ' and '
-			msg += f'{dir_error_cnt} missing dir(s)'
-		if other_cnt:
+			msg += f'{self.dir_error_cnt} missing dir(s)'
+		if self.other_cnt:
 			if msg:
 				msg += ' and '
-			msg += f'{other_cnt} other object(s) not included'
+			msg += f'{self.other_cnt} other object(s) not included'
 		if msg:
 			self.log.warning(msg)
 		if not hashes:
@@ -90,12 +216,43 @@ class ZipImager:
 		self.log.info('Calculating hash(es)', echo=True)
 		self.txt_path = self.outdir / f'{self.filename}_hash.txt'
 		with self.txt_path.open('w', encoding='utf-8') as fh:
-			for alg in hashes:
-				hash = FileHash.hashsum(self.image_path, algorithm=alg)
+			if pieces:	# hash pieces in parallel and keep their digests for partial verification
+				piece_hash = PieceHash(self.image_path)
+				digests = piece_hash.calculate(algorithms=hashes)
+				self.pieces_path = piece_hash.write(self.outdir / f'{self.filename}_pieces.tsv')
+			else:
+				digests = FileHash.hashsums(self.image_path, algorithms=hashes)
+			for alg, hash in zip(hashes, digests):
 				self.log.info(f'Calculated {alg} hash: {hash}', echo=True)
 				print(f'{alg}\t{hash}', file=fh)
+			if pieces:
+				self.log.info(f'Merkle root of {len(piece_hash.digests)} {piece_hash.algorithm} piece digest(s): {piece_hash.merkle_root}, check {self.pieces_path}', echo=True)
+				print(f'merkle_root\t{piece_hash.merkle_root}', file=fh)
 		self.log.info('Finished calculating hashes', echo=True)
 
+	def verify_pieces(self, image, filename=None, outdir=None, log=None):
+		'''Re-hash the pieces of a zip file created with pieces=True and log damaged byte ranges'''
+		self.image_path = Path(image)
+		self.pieces_path = self.image_path.with_name(f'{self.image_path.stem}_pieces.tsv')
+		self.filename = TimeStamp.now_or(filename, base='verify')
+		self.outdir = PathUtils.mkdir(outdir)
+		self.log = log if log else Logger(
+			filename=self.filename, outdir=self.outdir, head='zipimager.ZipImager', echo=self.echo)
+		for path in (self.image_path, self.pieces_path):
+			if not path.is_file():
+				self.log.error(f'Unable to read {path}')
+		self.log.info(f'Verifying {self.image_path} by the piece digests in {self.pieces_path}', echo=True)
+		try:
+			damaged = PieceHash(self.image_path).verify(self.pieces_path)
+		except (OSError, ValueError, IndexError) as ex:
+			self.log.error(f'Unable to verify {self.image_path}: {ex}')
+		if not damaged:
+			self.log.info(f'All pieces of {self.image_path.name} are unchanged', echo=True)
+			return
+		for offset, size in damaged:
+			self.log.warning(f'{size} byte(s) at offset {offset} differ', echo=False)
+		self.log.warning(f'{len(damaged)} damaged range(s) in {self.image_path.name}, {StringUtils.bytes(sum(size for offset, size in damaged))}')
+
 class ZipImagerCli(ArgumentParser):
 	'''CLI for the imager'''
 
@@ -109,10 +266,36 @@ class ZipImagerCli(ArgumentParser):
 		self.add_argument('-f', '--filename', type=str,
 			help='Filename to generated (without extension)', metavar='STRING'
 		)
+		self.add_argument('-i', '--include', type=str, action='append',
+			help='Zip only files matching glob or regex (prefix "re:"), can be given multiple times', metavar='RULE'
+		)
+		self.add_argument('-k', '--known', type=Path, action='append',
+			help='Index file (built by HashIndexer) with hashes of known files, can be given multiple times', metavar='FILE'
+		)
+		self.add_argument('-l', '--limit', type=str, action='append',
+			help='Limit I/O bandwidth per device, PATH=MB/S only limits the device holding PATH, can be given multiple times (default: no limit)',
+			metavar='MB/S|PATH=MB/S'
+		)
 		self.add_argument('-o', '--outdir', type=Path,
 			help='Directory to write generated files (default: current)', metavar='DIRECTORY'
 		)
-		self.add_argument('root', nargs=1, type=Path,
+		self.add_argument('-p', '--pieces', default=False, action='store_true',
+			help=f'Hash pieces of {PieceHash.PIECE_SIZE // 1048576} MiB in parallel, write their digests and a Merkle root'
+		)
+		self.add_argument('-s', '--physical', default=False, action='store_true',
+			help='Read files in the order of their position on the source disk (for spinning disks)'
+		)
+		self.add_argument('-u', '--exclude', type=str, action='append',
+			help='Skip files and directories matching glob or regex (prefix "re:"), can be given multiple times', metavar='RULE'
+		)
+		self.add_argument('-v', '--verify', type=Path,
+			help='Verify zip file created with --pieces by its piece digests (FILENAME_pieces.tsv next to it, no root needed)',
+			metavar='FILE'
+		)
+		self.add_argument('-x', '--alert', type=Path, action='append',
+			help='Index file (built by HashIndexer) with hashes to alert on, can be given multiple times', metavar='FILE'
+		)
+		self.add_argument('root', nargs='?', type=Path,
 			help='Source root', metavar='DIRECTORY'
 		)
 		self.echo = echo
@@ -120,18 +303,39 @@ class ZipImagerCli(ArgumentParser):
 	def parse(self, *cmd):
 		'''Parse arguments'''
 		args = super().parse_args(*cmd)
-		self.root = args.root[0]
+		self.verify = args.verify
+		if not self.verify and not args.root:
+			self.error('the argument root is required to create a zip file')
+		self.root = args.root
 		self.filename = args.filename
 		self.outdir = args.outdir
 		self.algorithms = FileHash.parse_algorithms(args.algorithms)
+		self.pieces = args.pieces
+		self.known = args.known
+		self.alert = args.alert
+		self.physical = args.physical
+		self.limit = args.limit
+		self.include = args.include
+		self.exclude = args.exclude
 
 	def run(self):
 		'''Run the imager'''
 		imager = ZipImager(echo=self.echo)
+		if self.verify:
+			imager.verify_pieces(self.verify, filename=self.filename, outdir=self.outdir)
+			imager.log.close()
+			return
 		imager.create(self.root,
 			filename = self.filename,
 			outdir = self.outdir,
-			hashes = self.algorithms
+			hashes = self.algorithms,
+			pieces = self.pieces,
+			known = self.known,
+			alert = self.alert,
+			physical = self.physical,
+			limit = self.limit,
+			include = self.include,
+			exclude = self.exclude
 		)
 		imager.log.close()
 